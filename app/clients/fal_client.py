@@ -1,7 +1,16 @@
-from pathlib import Path
+import asyncio
+import base64
+import io
+import os
+import random
+from datetime import datetime
+from typing import Awaitable, Callable
 
 from dotenv import load_dotenv
 import fal_client
+from fal_client.client import CDNToken, FalClientHTTPError
+import httpx
+from PIL import Image, ImageOps
 
 load_dotenv()
 
@@ -9,7 +18,20 @@ load_dotenv()
 OUTPUT_FORMAT = "jpeg"
 NUM_IMAGES = 1
 FAL_MODEL = "fal-ai/nano-banana/edit"
+FAL_QUEUE_URL = "https://queue.fal.run/"
+FAL_CDN_TOKEN_URL = "https://rest.alpha.fal.ai/storage/auth/token?storage_type=fal-cdn-v3"
+FAL_CDN_UPLOAD_URL = "https://v3.fal.media/files/upload"
 ASPECT_RATIO = "1:1"
+FAL_REQUEST_TIMEOUT_SECONDS = 30.0
+FAL_JOB_TIMEOUT_SECONDS = 300.0
+FAL_POLL_INTERVAL_SECONDS = 0.5
+# Transient failures retried the way fal_client retries its own requests: timeouts and
+# connection errors, 408/409/429, and 502-504 from the ingress (no x-fal-request-id).
+FAL_RETRY_ATTEMPTS = 5
+FAL_RETRY_BASE_DELAY_SECONDS = 0.1
+FAL_RETRY_MAX_DELAY_SECONDS = 10.0
+FAL_RETRY_STATUS_CODES = (408, 409, 429)
+FAL_INGRESS_ERROR_CODES = (502, 503, 504)
 
 LOCKED_PROMPT = """Transform the person in the uploaded photo into a photorealistic classic 1970s firefighter portrait.
 Preserve facial identity while changing clothing and styling.
@@ -21,21 +43,191 @@ No collage or mixed-media effects.
 Return a single high-quality portrait image."""
 
 
+# Progress callbacks receive a stage ("queued", "generating") and, while queued, the
+# position in fal's queue (0 = next up). They are awaited, so they may persist it.
+ProgressCallback = Callable[[str, int | None], Awaitable[None]]
+
+
 class FalAPIClient:
-    def generate_firefighter_image(self, source_path: Path) -> str:
-        source_url = fal_client.upload_file(source_path)
+    """
+    Async fal client meant to be created once per process. Uploads to fal storage,
+    queue submits, status polls and results go over one pooled httpx session owned
+    here (and closed by aclose()); fal_client.AsyncRequestHandle does the polling on
+    it. Requests made here raise fal_client's FalClientHTTPError and retry transient
+    failures as fal_client does. `timeout` bounds each HTTP request, `job_timeout` the
+    whole job. A given `http_client` is owned and closed likewise.
+
+    Pass `source_url` when the photo is already reachable over HTTPS (e.g. a
+    presigned S3 URL) to skip uploading the bytes to fal storage.
+    """
+
+    def __init__(
+        self,
+        key: str | None = None,
+        timeout: float = FAL_REQUEST_TIMEOUT_SECONDS,
+        job_timeout: float = FAL_JOB_TIMEOUT_SECONDS,
+        http_client: httpx.AsyncClient | None = None,
+    ) -> None:
+        self.job_timeout = job_timeout
+        self._http = http_client or httpx.AsyncClient(timeout=timeout)
+        self._http.headers["Authorization"] = f"Key {key or os.getenv('FAL_KEY', '')}"
+        self._cdn_token: CDNToken | None = None
+        self._cdn_token_lock = asyncio.Lock()
 
-        result = fal_client.subscribe(
-            FAL_MODEL,
-            arguments={
+    async def generate_firefighter_image(
+        self,
+        source: bytes,
+        content_type: str,
+        on_progress: ProgressCallback | None = None,
+        source_url: str | None = None,
+    ) -> str:
+        return await asyncio.wait_for(self._generate(source, content_type, on_progress, source_url), self.job_timeout)
+
+    async def _generate(
+        self,
+        source: bytes,
+        content_type: str,
+        on_progress: ProgressCallback | None,
+        source_url: str | None,
+    ) -> str:
+        if source_url is None:
+            source_url = await self._upload(source, content_type)
+        handle = await self._submit(
+            {
                 "prompt": LOCKED_PROMPT,
                 "num_images": NUM_IMAGES,
                 "aspect_ratio": ASPECT_RATIO,
                 "output_format": OUTPUT_FORMAT,
                 "image_urls": [source_url],
-            },
-            with_logs=True,
-            on_queue_update=lambda status: print(f"Status: {status}"),
+            }
         )
-
+        async for status in handle.iter_events(interval=FAL_POLL_INTERVAL_SECONDS):
+            if on_progress is None:
+                continue
+            if isinstance(status, fal_client.Queued):
+                await on_progress("queued", status.position)
+            elif isinstance(status, fal_client.InProgress):
+                await on_progress("generating", None)
+        result = await handle.get()
         return result["images"][0]["url"]
+
+    async def _upload(self, data: bytes, content_type: str) -> str:
+        # Uploads are capped far below fal's multipart threshold, so one POST does.
+        response = await self._request(
+            "POST",
+            FAL_CDN_UPLOAD_URL,
+            content=data,
+            headers={"Content-Type": content_type, "Authorization": await self._cdn_authorization()},
+        )
+        return response.json()["access_url"]
+
+    async def _cdn_authorization(self) -> str:
+        """Authorization header for fal storage, from a CDN token cached until it expires."""
+        async with self._cdn_token_lock:
+            if self._cdn_token is None or self._cdn_token.is_expired():
+                data = (await self._request("POST", FAL_CDN_TOKEN_URL, json={})).json()
+                self._cdn_token = CDNToken(
+                    token=data["token"],
+                    token_type=data["token_type"],
+                    base_upload_url=data["base_url"],
+                    expires_at=datetime.fromisoformat(data["expires_at"]),
+                )
+            return f"{self._cdn_token.token_type} {self._cdn_token.token}"
+
+    async def _submit(self, arguments: dict) -> fal_client.AsyncRequestHandle:
+        data = (await self._request("POST", FAL_QUEUE_URL + FAL_MODEL, json=arguments)).json()
+        return fal_client.AsyncRequestHandle(
+            request_id=data["request_id"],
+            response_url=data["response_url"],
+            status_url=data["status_url"],
+            cancel_url=data["cancel_url"],
+            client=self._http,
+        )
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        for attempt in range(1, FAL_RETRY_ATTEMPTS + 1):
+            last = attempt == FAL_RETRY_ATTEMPTS
+            try:
+                response = await self._http.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if last:
+                    raise
+            else:
+                if last or not _is_transient(response):
+                    _raise_for_status(response)
+                    return response
+            delay = min(FAL_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1), FAL_RETRY_MAX_DELAY_SECONDS)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        raise AssertionError("unreachable")
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+def _is_transient(response: httpx.Response) -> bool:
+    if response.status_code in FAL_RETRY_STATUS_CODES:
+        return True
+    return response.status_code in FAL_INGRESS_ERROR_CODES and "x-fal-request-id" not in response.headers
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    """Raise fal_client's FalClientHTTPError, with fal's `detail` as the message, for non-2xx responses."""
+    if response.is_success:
+        return
+    try:
+        message = response.json()["detail"]
+    except (ValueError, KeyError, TypeError):
+        message = response.text
+    raise FalClientHTTPError(message, response.status_code, dict(response.headers), response=response)
+
+
+class FakeFalClient:
+    """
+    Offline stand-in for local runs, load tests and benchmarks: walks through
+    `queue_depth` queue positions and a generating stage over `delay_seconds`, then
+    returns the source photo square-cropped and warm-tinted as a data: URL.
+    Needs no network and no FAL_KEY; `source_url` is accepted and ignored.
+    """
+
+    def __init__(self, delay_seconds: float = 0.0, queue_depth: int = 0) -> None:
+        self.delay_seconds = delay_seconds
+        self.queue_depth = queue_depth
+
+    async def generate_firefighter_image(
+        self,
+        source: bytes,
+        content_type: str,
+        on_progress: ProgressCallback | None = None,
+        source_url: str | None = None,
+    ) -> str:
+        step = self.delay_seconds / (self.queue_depth + 1)
+        for position in range(self.queue_depth - 1, -1, -1):
+            if on_progress:
+                await on_progress("queued", position)
+            await asyncio.sleep(step)
+        if on_progress:
+            await on_progress("generating", None)
+        await asyncio.sleep(step)
+        return await asyncio.to_thread(_fake_render, source)
+
+    async def aclose(self) -> None:
+        return None
+
+
+def _fake_render(source: bytes) -> str:
+    with Image.open(io.BytesIO(source)) as image:
+        square = ImageOps.fit(image.convert("RGB"), (1024, 1024))
+    tinted = Image.blend(square, Image.new("RGB", square.size, (230, 120, 40)), 0.2)
+    buf = io.BytesIO()
+    tinted.save(buf, format="JPEG", quality=90)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def create_fal_client(settings) -> FalAPIClient | FakeFalClient:
+    if settings.fal_backend == "fake":
+        return FakeFalClient(settings.fake_fal_delay_seconds, settings.fake_fal_queue_depth)
+    return FalAPIClient(
+        settings.fal_key,
+        timeout=settings.fal_request_timeout_seconds,
+        job_timeout=settings.fal_job_timeout_seconds,
+    )
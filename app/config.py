@@ -10,24 +10,51 @@ load_dotenv()
 @dataclass(frozen=True)
 class Settings:
     fal_key: str
+    fal_backend: str
+    fal_source: str
+    fal_request_timeout_seconds: float
+    fal_job_timeout_seconds: float
+    fake_fal_delay_seconds: float
+    fake_fal_queue_depth: int
     s3_endpoint_url: str
     s3_bucket: str
     s3_region: str
     s3_access_key_id: str
     s3_secret_access_key: str
     s3_public_base_url: str
+    image_delivery: str
     s3_signed_url_ttl_seconds: int
+    s3_max_pool_connections: int
+    s3_tcp_keepalive: bool
+    s3_presign_cache_size: int
+    s3_presign_min_remaining: float
+    storage_backend: str
+    local_storage_dir: str
     rate_limit_per_min: int
     rate_limit_per_day: int
+    rate_limit_max_keys: int
+    rate_limit_backend: str
+    rate_limit_db_path: str
     gen_max_concurrency: int
     gen_max_queue: int
+    gen_cpu_workers: int
+    gen_worker_mode: str
+    gen_job_max_attempts: int
+    gen_job_retry_backoff_seconds: float
     processing_timeout_seconds: int
     allowed_origins: tuple[str, ...]
     allowed_hosts: tuple[str, ...]
     trust_proxy_headers: bool
     selfie_ttl_days: int
     frame_asset_path: str
+    final_image_format: str
     db_path: str
+    db_pooled: bool
+    result_cache_size: int
+    result_cache_ttl_seconds: float
+    result_cache_processing_ttl_seconds: float
+    metrics_enabled: bool
+    metrics_token: str
 
     @classmethod
     def load(cls, validate: bool = True) -> "Settings":
@@ -37,15 +64,27 @@ class Settings:
         s3_access_key_id = os.getenv("S3_ACCESS_KEY", "")
         s3_secret_access_key = os.getenv("S3_SECRET_KEY", "")
         s3_endpoint_url = f"https://s3.{s3_region}.amazonaws.com" if s3_region else ""
-        s3_public_base_url = f"https://{s3_bucket}.s3.{s3_region}.amazonaws.com" if s3_bucket and s3_region else ""
+        s3_public_base_url = os.getenv("S3_PUBLIC_BASE_URL", "").strip().rstrip("/") or (
+            f"https://{s3_bucket}.s3.{s3_region}.amazonaws.com" if s3_bucket and s3_region else ""
+        )
+        image_delivery = os.getenv("IMAGE_DELIVERY", "signed").strip().lower()
+
+        storage_backend = os.getenv("STORAGE_BACKEND", "s3").strip().lower()
+        fal_backend = os.getenv("FAL_BACKEND", "fal").strip().lower()
+        fal_source = os.getenv("FAL_SOURCE", "upload").strip().lower()
 
-        required = {
-            "FAL_KEY": fal_key,
-            "S3_BUCKET": s3_bucket,
-            "S3_REGION": s3_region,
-            "S3_ACCESS_KEY": s3_access_key_id,
-            "S3_SECRET_KEY": s3_secret_access_key,
-        }
+        required = {}
+        if fal_backend == "fal":
+            required["FAL_KEY"] = fal_key
+        if storage_backend == "s3":
+            required.update(
+                {
+                    "S3_BUCKET": s3_bucket,
+                    "S3_REGION": s3_region,
+                    "S3_ACCESS_KEY": s3_access_key_id,
+                    "S3_SECRET_KEY": s3_secret_access_key,
+                }
+            )
 
         if validate:
             missing = [name for name, value in required.items() if not value]
@@ -55,11 +94,26 @@ class Settings:
 
         selfie_ttl_days = int(os.getenv("SELFIE_TTL_DAYS", "30"))
         s3_signed_url_ttl_seconds = int(os.getenv("S3_QR_EXPIRY", "3600"))
+        s3_max_pool_connections = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+        s3_tcp_keepalive = os.getenv("S3_TCP_KEEPALIVE", "true").lower() in {"1", "true", "yes"}
+        s3_presign_cache_size = int(os.getenv("S3_PRESIGN_CACHE_SIZE", "10000"))
+        s3_presign_min_remaining = float(os.getenv("S3_PRESIGN_MIN_REMAINING", "0.5"))
         rate_limit_per_min = int(os.getenv("RATE_LIMIT_PER_MIN", "3"))
         rate_limit_per_day = int(os.getenv("RATE_LIMIT_PER_DAY", "20"))
+        rate_limit_max_keys = int(os.getenv("RATE_LIMIT_MAX_KEYS", "500000"))
+        rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
         gen_max_concurrency = int(os.getenv("GEN_MAX_CONCURRENCY", "5"))
         gen_max_queue = int(os.getenv("GEN_MAX_QUEUE", "50"))
+        gen_cpu_workers = int(os.getenv("GEN_CPU_WORKERS", "0"))
+        fal_request_timeout_seconds = float(os.getenv("FAL_REQUEST_TIMEOUT_SECONDS", "30"))
+        fal_job_timeout_seconds = float(os.getenv("FAL_JOB_TIMEOUT_SECONDS", "300"))
+        gen_worker_mode = os.getenv("GEN_WORKER_MODE", "inline").strip().lower()
+        gen_job_max_attempts = int(os.getenv("GEN_JOB_MAX_ATTEMPTS", "2"))
+        gen_job_retry_backoff_seconds = float(os.getenv("GEN_JOB_RETRY_BACKOFF_SECONDS", "5"))
         processing_timeout_seconds = int(os.getenv("PROCESSING_TIMEOUT_SECONDS", "600"))
+        result_cache_size = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+        result_cache_ttl_seconds = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+        result_cache_processing_ttl_seconds = float(os.getenv("RESULT_CACHE_PROCESSING_TTL_SECONDS", "5"))
         trust_proxy_headers = os.getenv("TRUST_PROXY_HEADERS", "false").lower() in {"1", "true", "yes"}
 
         default_origins = (
@@ -84,38 +138,98 @@ class Settings:
         allowed_hosts = tuple(h.strip() for h in raw_hosts.split(",") if h.strip()) or default_hosts
 
         frame_asset_path = os.getenv("FRAME_ASSET_PATH", "app/static/campaign/frame_v1.png")
+        final_image_format = os.getenv("FINAL_IMAGE_FORMAT", "png").strip().lower()
         if validate:
             if selfie_ttl_days <= 0:
                 raise RuntimeError("SELFIE_TTL_DAYS must be greater than zero")
             if s3_signed_url_ttl_seconds <= 0:
                 raise RuntimeError("S3_QR_EXPIRY must be greater than zero")
-            if rate_limit_per_min <= 0 or rate_limit_per_day <= 0:
+            if s3_max_pool_connections <= 0:
+                raise RuntimeError("S3_MAX_POOL_CONNECTIONS must be greater than zero")
+            if s3_presign_cache_size < 0:
+                raise RuntimeError("S3_PRESIGN_CACHE_SIZE must be zero or greater")
+            if not 0 < s3_presign_min_remaining <= 1:
+                raise RuntimeError("S3_PRESIGN_MIN_REMAINING must be greater than zero and at most 1")
+            if image_delivery not in {"signed", "public"}:
+                raise RuntimeError("IMAGE_DELIVERY must be one of: signed, public")
+            if storage_backend not in {"s3", "local"}:
+                raise RuntimeError("STORAGE_BACKEND must be one of: s3, local")
+            if rate_limit_per_min <= 0 or rate_limit_per_day <= 0 or rate_limit_max_keys <= 0:
                 raise RuntimeError("Rate limits must be greater than zero")
+            if rate_limit_backend not in {"memory", "sqlite"}:
+                raise RuntimeError("RATE_LIMIT_BACKEND must be one of: memory, sqlite")
             if gen_max_concurrency <= 0 or gen_max_queue <= 0:
                 raise RuntimeError("Generation limits must be greater than zero")
+            if gen_cpu_workers < 0:
+                raise RuntimeError("GEN_CPU_WORKERS must be zero or greater")
+            if gen_worker_mode not in {"inline", "external"}:
+                raise RuntimeError("GEN_WORKER_MODE must be one of: inline, external")
+            if fal_backend not in {"fal", "fake"}:
+                raise RuntimeError("FAL_BACKEND must be one of: fal, fake")
+            if fal_source not in {"upload", "storage"}:
+                raise RuntimeError("FAL_SOURCE must be one of: upload, storage")
+            if fal_source == "storage" and fal_backend == "fal" and storage_backend != "s3":
+                raise RuntimeError("FAL_SOURCE=storage needs STORAGE_BACKEND=s3 so fal can fetch the upload")
+            if fal_request_timeout_seconds <= 0 or fal_job_timeout_seconds <= 0:
+                raise RuntimeError("fal timeouts must be greater than zero")
+            if gen_job_max_attempts <= 0:
+                raise RuntimeError("GEN_JOB_MAX_ATTEMPTS must be greater than zero")
+            if gen_job_retry_backoff_seconds < 0:
+                raise RuntimeError("GEN_JOB_RETRY_BACKOFF_SECONDS must be zero or greater")
             if processing_timeout_seconds <= 0:
                 raise RuntimeError("PROCESSING_TIMEOUT_SECONDS must be greater than zero")
+            if result_cache_size < 0 or result_cache_ttl_seconds < 0 or result_cache_processing_ttl_seconds < 0:
+                raise RuntimeError("Result cache settings must be zero or greater")
             if not Path(frame_asset_path).exists():
                 raise RuntimeError(f"FRAME_ASSET_PATH does not exist: {frame_asset_path}")
+            if final_image_format not in {"png", "webp", "jpeg"}:
+                raise RuntimeError("FINAL_IMAGE_FORMAT must be one of: png, webp, jpeg")
 
         return cls(
             fal_key=fal_key,
+            fal_backend=fal_backend,
+            fal_source=fal_source,
+            fal_request_timeout_seconds=fal_request_timeout_seconds,
+            fal_job_timeout_seconds=fal_job_timeout_seconds,
+            fake_fal_delay_seconds=float(os.getenv("FAKE_FAL_DELAY_SECONDS", "0")),
+            fake_fal_queue_depth=int(os.getenv("FAKE_FAL_QUEUE_DEPTH", "0")),
             s3_endpoint_url=s3_endpoint_url,
             s3_bucket=s3_bucket,
             s3_region=s3_region,
             s3_access_key_id=s3_access_key_id,
             s3_secret_access_key=s3_secret_access_key,
             s3_public_base_url=s3_public_base_url,
+            image_delivery=image_delivery,
             s3_signed_url_ttl_seconds=s3_signed_url_ttl_seconds,
+            s3_max_pool_connections=s3_max_pool_connections,
+            s3_tcp_keepalive=s3_tcp_keepalive,
+            s3_presign_cache_size=s3_presign_cache_size,
+            s3_presign_min_remaining=s3_presign_min_remaining,
+            storage_backend=storage_backend,
+            local_storage_dir=os.getenv("LOCAL_STORAGE_DIR", "app/data/storage"),
             rate_limit_per_min=rate_limit_per_min,
             rate_limit_per_day=rate_limit_per_day,
+            rate_limit_max_keys=rate_limit_max_keys,
+            rate_limit_backend=rate_limit_backend,
+            rate_limit_db_path=os.getenv("RATE_LIMIT_DB_PATH", "app/data/limits.db"),
             gen_max_concurrency=gen_max_concurrency,
             gen_max_queue=gen_max_queue,
+            gen_cpu_workers=gen_cpu_workers,
+            gen_worker_mode=gen_worker_mode,
+            gen_job_max_attempts=gen_job_max_attempts,
+            gen_job_retry_backoff_seconds=gen_job_retry_backoff_seconds,
             processing_timeout_seconds=processing_timeout_seconds,
             allowed_origins=allowed_origins,
             allowed_hosts=allowed_hosts,
             trust_proxy_headers=trust_proxy_headers,
             selfie_ttl_days=selfie_ttl_days,
             frame_asset_path=frame_asset_path,
+            final_image_format=final_image_format,
             db_path=os.getenv("RESULTS_DB_PATH", "app/data/results.db"),
+            db_pooled=os.getenv("RESULTS_DB_POOLED", "true").lower() in {"1", "true", "yes"},
+            result_cache_size=result_cache_size,
+            result_cache_ttl_seconds=result_cache_ttl_seconds,
+            result_cache_processing_ttl_seconds=result_cache_processing_ttl_seconds,
+            metrics_enabled=os.getenv("METRICS_ENABLED", "false").lower() in {"1", "true", "yes"},
+            metrics_token=os.getenv("METRICS_TOKEN", ""),
         )
@@ -1,18 +1,30 @@
 import asyncio
 import logging
+import signal
 from contextlib import asynccontextmanager
+from pathlib import Path
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 
+from app.clients.fal_client import create_fal_client
 from app.config import Settings
-from app.routes import api, pages
+from app.routes import api, metrics, pages
+from app.services.admission import InProcessSlots, SqliteSlots
 from app.services.cleanup import cleanup_loop
+from app.services.cpu_pool import create_cpu_pool
+from app.services.image_pipeline import create_download_client, reload_frame_assets, warm_frame_cache
+from app.services.job_queue import JobDispatcher, requeue_orphaned_jobs
+from app.services.notify import ResultNotifier
+from app.services.ownership import worker_identity
+from app.services.result_cache import CachedResultsRepository, ResultCache
 from app.services.results_repo import ResultsRepository
-from app.services.ratelimit import InProcessRateLimiter
-from app.services.storage import S3Storage
+from app.services.ratelimit import InProcessRateLimiter, SqliteRateLimiter
+from app.services.storage import create_storage
+
+logger = logging.getLogger(__name__)
 
 
 def _add_security_headers(response) -> None:
@@ -32,39 +44,128 @@ def _add_security_headers(response) -> None:
     )
 
 
+def _create_repository(settings: Settings) -> ResultsRepository:
+    if settings.result_cache_size <= 0:
+        return ResultsRepository(settings.db_path, pooled=settings.db_pooled)
+    cache = ResultCache(
+        max_entries=settings.result_cache_size,
+        ttl_seconds=settings.result_cache_ttl_seconds,
+        processing_ttl_seconds=settings.result_cache_processing_ttl_seconds,
+    )
+    return CachedResultsRepository(settings.db_path, cache, pooled=settings.db_pooled)
+
+
+def _create_limits(settings: Settings, owner: str):
+    """Rate limiter and job-concurrency slots for the configured backend; `owner` holds the slots."""
+    if settings.rate_limit_backend == "sqlite":
+        # Shared by every worker process on the host, so the limits are global.
+        rate_limiter = SqliteRateLimiter(
+            settings.rate_limit_db_path,
+            settings.rate_limit_per_min,
+            settings.rate_limit_per_day,
+            max_keys=settings.rate_limit_max_keys,
+        )
+        run_slots = SqliteSlots(settings.rate_limit_db_path, "run", settings.gen_max_concurrency, owner)
+        return rate_limiter, run_slots
+    rate_limiter = InProcessRateLimiter(
+        settings.rate_limit_per_min,
+        settings.rate_limit_per_day,
+        max_keys=settings.rate_limit_max_keys,
+    )
+    return rate_limiter, InProcessSlots(settings.gen_max_concurrency)
+
+
+async def _reload_frames(app: FastAPI) -> None:
+    settings = app.state.settings
+    await asyncio.to_thread(reload_frame_assets)
+    # Pool workers hold their own frame cache; swap in fresh ones and let the old ones drain.
+    old_pool = app.state.cpu_pool
+    if old_pool:
+        app.state.cpu_pool = create_cpu_pool(settings.gen_cpu_workers, settings.frame_asset_path)
+        old_pool.shutdown(wait=False)
+    logger.info("frame_assets_reloaded")
+
+
+def _install_reload_signal(app: FastAPI) -> bool:
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(_reload_frames(app)))
+    except (NotImplementedError, RuntimeError, ValueError):
+        # Not on the main thread (e.g. TestClient) or unsupported platform.
+        return False
+    return True
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     cleanup_task = None
+    dispatcher_task = None
+    reload_signal = False
     try:
         settings = app.state.settings
-        repo = ResultsRepository(settings.db_path)
+        repo = _create_repository(settings)
         repo.init_db()
         app.state.repo = repo
+        app.state.notifier = ResultNotifier(asyncio.get_running_loop())
         app.state.storage = None
-        app.state.gen_semaphore = asyncio.Semaphore(settings.gen_max_concurrency)
-        app.state.gen_inflight = 0
-        app.state.gen_inflight_lock = asyncio.Lock()
-        app.state.rate_limiter = InProcessRateLimiter(settings.rate_limit_per_min, settings.rate_limit_per_day)
-
-        if settings.s3_bucket and settings.s3_endpoint_url and settings.s3_public_base_url:
-            storage = S3Storage(
-                endpoint_url=settings.s3_endpoint_url,
-                bucket=settings.s3_bucket,
-                region=settings.s3_region,
-                access_key=settings.s3_access_key_id,
-                secret_key=settings.s3_secret_access_key,
-                public_base_url=settings.s3_public_base_url,
-            )
-            app.state.storage = storage
+        app.state.job_owner = worker_identity()
+        app.state.rate_limiter, app.state.gen_run_slots = _create_limits(settings, app.state.job_owner)
+        app.state.cpu_pool = create_cpu_pool(settings.gen_cpu_workers, settings.frame_asset_path)
+        app.state.fal_client = create_fal_client(settings)
+        app.state.http_client = create_download_client()
+        if Path(settings.frame_asset_path).exists():
+            await asyncio.to_thread(warm_frame_cache, settings.frame_asset_path)
+        reload_signal = _install_reload_signal(app)
+
+        storage = create_storage(settings)
+        app.state.storage = storage
+        if storage:
             cleanup_task = asyncio.create_task(cleanup_loop(repo, storage))
+
+        app.state.dispatcher = None
+        if settings.gen_worker_mode == "inline":
+            requeue_orphaned_jobs(repo, app.state.job_owner, settings.gen_job_max_attempts)
+            app.state.dispatcher = JobDispatcher(app, app.state.job_owner)
+            dispatcher_task = asyncio.create_task(app.state.dispatcher.run())
+        # In external mode `python -m app.worker` runs the jobs; this process only enqueues.
         yield
     finally:
+        if dispatcher_task:
+            # Jobs cut short here keep their queue rows and are picked up on the next start.
+            dispatcher_task.cancel()
+            try:
+                await dispatcher_task
+            except asyncio.CancelledError:
+                pass
         if cleanup_task:
             cleanup_task.cancel()
             try:
                 await cleanup_task
             except asyncio.CancelledError:
                 pass
+        if reload_signal:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        fal_client = getattr(app.state, "fal_client", None)
+        if fal_client:
+            await fal_client.aclose()
+        http_client = getattr(app.state, "http_client", None)
+        if http_client:
+            await http_client.aclose()
+        storage = getattr(app.state, "storage", None)
+        if storage:
+            storage.close()
+        cpu_pool = getattr(app.state, "cpu_pool", None)
+        if cpu_pool:
+            cpu_pool.shutdown(wait=False, cancel_futures=True)
+        for name in ("rate_limiter", "gen_run_slots"):
+            limits = getattr(app.state, name, None)
+            if limits is not None:
+                limits.close()
+        repo = getattr(app.state, "repo", None)
+        if repo:
+            repo.close()
 
 
 def create_app(validate_env: bool = True) -> FastAPI:
@@ -91,8 +192,12 @@ def create_app(validate_env: bool = True) -> FastAPI:
         return response
 
     app.mount("/static", StaticFiles(directory="app/static"), name="static")
+    if settings.storage_backend == "local":
+        Path(settings.local_storage_dir).mkdir(parents=True, exist_ok=True)
+        app.mount("/local-storage", StaticFiles(directory=settings.local_storage_dir), name="local-storage")
 
     app.include_router(api.router, prefix="/api")
     app.include_router(pages.router)
+    app.include_router(metrics.router)
 
     return app
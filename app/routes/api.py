@@ -1,17 +1,21 @@
 import asyncio
 import hashlib
 import io
-import tempfile
+import json
+import time
 import uuid
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from urllib.parse import urlparse
 
 from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from PIL import Image
+from starlette.formparsers import MultiPartParser
 
-from app.services.job_runner import run_generation_job
+from app.services.cpu_pool import run_cpu
+from app.services.http_cache import etag_matches, result_cache_control, strong_etag
+from app.services.metrics import span
 from app.services.image_pipeline import (
     ValidationError,
     MAX_UPLOAD_BYTES,
@@ -22,12 +26,19 @@ from app.services.ratelimit import RateLimitExceeded
 router = APIRouter()
 PROMPT_VERSION = "v1-fireman-1970s-ei"
 RETRY_AFTER_SECONDS = 2
+# How often a status stream re-reads the result without a notification
+# (covers writes from other processes) and sends a keep-alive.
+EVENTS_RECHECK_SECONDS = 5
 MIME_EXT = {
     "image/jpeg": "jpg",
     "image/png": "png",
     "image/webp": "webp",
 }
 
+# Starlette spools multipart file parts above 1 MiB to a temp file. Keep any upload we
+# accept in memory instead; larger bodies still roll over to disk before the 413 below.
+MultiPartParser.spool_max_size = max(MultiPartParser.spool_max_size, MAX_UPLOAD_BYTES)
+
 
 def _is_expired(expires_at: str) -> bool:
     expires = datetime.fromisoformat(expires_at)
@@ -94,7 +105,7 @@ def _enforce_origin(request: Request) -> None:
         raise HTTPException(status_code=403, detail="Origin not allowed")
 
 
-def _build_result_payload(request: Request, row) -> dict:
+def build_result_payload(request: Request, row) -> dict:
     base = str(request.base_url).rstrip("/")
     if _is_expired(row.expires_at):
         return {
@@ -111,13 +122,34 @@ def _build_result_payload(request: Request, row) -> dict:
     }
 
     if row.status == "ready" and row.final_object_key:
+        image_route = f"{base}/api/selfie/result/{row.id}/image"
+        storage = request.app.state.storage
+        public = request.app.state.settings.image_delivery == "public"
+
+        def absolute(url: str) -> str:
+            return url if "://" in url else base + url
+
+        def variant_url(key: str, variant: str) -> str:
+            if public and storage is not None:
+                return absolute(storage.public_url(key))
+            return f"{image_route}?variant={variant}"
+
+        image_url = image_route
+        if public and row.public_image_url:
+            # Straight to the bucket/CDN; the signed redirect stays for private buckets.
+            image_url = absolute(row.public_image_url)
         payload.update(
             {
                 "status": "ready",
                 "download_url": f"{base}/api/selfie/result/{row.id}/download",
-                "image_url": f"{base}/api/selfie/result/{row.id}/image",
+                "image_url": image_url,
             }
         )
+        # Rows from before derivatives were rendered have neither.
+        if row.thumbnail_object_key:
+            payload["thumbnail_url"] = variant_url(row.thumbnail_object_key, "thumbnail")
+        if row.social_card_object_key:
+            payload["social_card_url"] = variant_url(row.social_card_object_key, "card")
         return payload
 
     if row.status == "failed":
@@ -125,6 +157,8 @@ def _build_result_payload(request: Request, row) -> dict:
         return payload
 
     payload.update({"status": "processing", "retry_after_seconds": RETRY_AFTER_SECONDS})
+    if row.progress_stage:
+        payload["progress"] = {"stage": row.progress_stage, "queue_position": row.queue_position}
     return payload
 
 
@@ -143,63 +177,69 @@ async def generate_selfie(
     _enforce_origin(request)
     client_ip = _get_client_ip(request)
 
-    scheduled = False
-    try:
-        if not client_request_id:
-            # Backwards compatibility: allow missing idempotency, but strongly prefer client-provided IDs.
-            client_request_id = str(uuid.uuid4())
+    if not client_request_id:
+        # Backwards compatibility: allow missing idempotency, but strongly prefer client-provided IDs.
+        client_request_id = str(uuid.uuid4())
 
-        ip_hash = _hash_ip(client_ip)
-        existing = repo.get_by_client_request_id(ip_hash, client_request_id)
-        if existing:
-            return _build_result_payload(request, existing)
+    ip_hash = _hash_ip(client_ip)
+    existing = repo.get_by_client_request_id(ip_hash, client_request_id)
+    if existing:
+        return build_result_payload(request, existing)
 
+    try:
+        await request.app.state.rate_limiter.acheck(client_ip)
+    except RateLimitExceeded as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(exc.retry_after_seconds)},
+        ) from exc
+
+    # Cheap early rejection before reading the body; enqueueing re-checks atomically.
+    if repo.count_jobs() >= settings.gen_max_queue:
+        raise HTTPException(status_code=429, detail="Too many requests, please try again soon")
+
+    content_length = request.headers.get("content-length")
+    if content_length:
         try:
-            request.app.state.rate_limiter.check(client_ip)
-        except RateLimitExceeded as exc:
-            raise HTTPException(
-                status_code=429,
-                detail="Rate limit exceeded",
-                headers={"Retry-After": str(exc.retry_after_seconds)},
-            ) from exc
-
-        async with request.app.state.gen_inflight_lock:
-            if request.app.state.gen_inflight >= settings.gen_max_queue:
-                raise HTTPException(status_code=429, detail="Too many requests, please try again soon")
-            request.app.state.gen_inflight += 1
-
-        content_length = request.headers.get("content-length")
-        if content_length:
-            try:
-                if int(content_length) > int(MAX_UPLOAD_BYTES) + (1024 * 1024):
-                    raise HTTPException(status_code=413, detail="Image is too large. Maximum size is 10MB.")
-            except ValueError:
-                pass
-
-        # Read with a hard cap to avoid unbounded memory usage.
-        photo_buffer = bytearray()
-        while True:
-            chunk = await photo.read(1024 * 1024)
-            if not chunk:
-                break
-            photo_buffer.extend(chunk)
-            if len(photo_buffer) > MAX_UPLOAD_BYTES:
+            if int(content_length) > int(MAX_UPLOAD_BYTES) + (1024 * 1024):
                 raise HTTPException(status_code=413, detail="Image is too large. Maximum size is 10MB.")
-        photo_bytes = bytes(photo_buffer)
-        content_type = photo.content_type
-
-        try:
-            validate_upload_bytes(photo_bytes, content_type)
-        except ValidationError as exc:
-            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        except ValueError:
+            pass
+
+    # Read with a hard cap to avoid unbounded memory usage. The part is still in memory
+    # (see spool_max_size above), and this single bytes object is shared by validation,
+    # the S3 upload and the fal upload without further copies.
+    with span("request_read"):
+        photo_bytes = await photo.read(MAX_UPLOAD_BYTES + 1)
+    if len(photo_bytes) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large. Maximum size is 10MB.")
+    content_type = photo.content_type
 
-        result_id = str(uuid.uuid4())
-        created_at = datetime.now(timezone.utc)
-        expires_at = created_at + timedelta(days=settings.selfie_ttl_days)
-        user_agent = request.headers.get("user-agent", "")
-        user_agent_hash = hashlib.sha256(user_agent.encode("utf-8")).hexdigest()[:32] if user_agent else None
-
-        repo.create_processing_result(
+    try:
+        with span("request_validate"):
+            await run_cpu(request.app.state.cpu_pool, validate_upload_bytes, photo_bytes, content_type)
+    except ValidationError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    result_id = str(uuid.uuid4())
+    created_at = datetime.now(timezone.utc)
+    expires_at = created_at + timedelta(days=settings.selfie_ttl_days)
+    user_agent = request.headers.get("user-agent", "")
+    user_agent_hash = hashlib.sha256(user_agent.encode("utf-8")).hexdigest()[:32] if user_agent else None
+
+    extension = MIME_EXT.get(content_type or "", "png")
+    upload_key = f"selfies/{result_id}/upload.{extension}"
+    content_type = content_type or "application/octet-stream"
+    dispatcher = request.app.state.dispatcher
+    if dispatcher is None:
+        # A separate worker process runs the job and reads the upload back from storage.
+        with span("request_store_upload"):
+            await storage.upload_bytes(upload_key, photo_bytes, content_type)
+    with span("request_enqueue"):
+        # BEGIN IMMEDIATE can wait on other writers; keep that off the event loop.
+        queued = await asyncio.to_thread(
+            repo.create_queued_result,
             result_id=result_id,
             created_at=created_at.isoformat(),
             expires_at=expires_at.isoformat(),
@@ -207,48 +247,126 @@ async def generate_selfie(
             user_agent_hash=user_agent_hash,
             client_request_id=client_request_id,
             ip_hash=ip_hash,
+            upload_object_key=upload_key,
+            content_type=content_type,
+            origin=request.app.state.job_owner,
+            max_queue=settings.gen_max_queue,
+            now=time.time(),
+            upload_stored=dispatcher is None,
         )
+    if not queued:
+        if dispatcher is None:
+            await storage.delete_object(upload_key)
+        raise HTTPException(status_code=429, detail="Too many requests, please try again soon")
 
-        extension = MIME_EXT.get(content_type or "", "png")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{extension}") as tmp:
-            tmp.write(photo_bytes)
-            tmp_path = tmp.name
-
-        row = repo.get_result(result_id)
-        if not row:
-            raise HTTPException(status_code=500, detail="Result save failed")
-        # Background job continues even if the user refreshes.
-        asyncio.create_task(
-            run_generation_job(
-                request.app,
-                result_id,
-                tmp_path,
-                extension,
-                content_type or "application/octet-stream",
-            )
-        )
-        scheduled = True
-        return _build_result_payload(request, row)
-    finally:
-        if not scheduled:
-            async with request.app.state.gen_inflight_lock:
-                request.app.state.gen_inflight = max(0, request.app.state.gen_inflight - 1)
+    row = repo.get_result(result_id)
+    if not row:
+        raise HTTPException(status_code=500, detail="Result save failed")
+    # The job is durable from here and continues even if the user refreshes.
+    if dispatcher is not None:
+        dispatcher.submit(result_id, photo_bytes)
+    return build_result_payload(request, row)
 
 
-@router.get("/selfie/result/{result_id}")
-async def get_result(request: Request, result_id: str) -> dict:
+def load_result(request: Request, result_id: str):
+    row = request.app.state.repo.get_result(result_id)
+    if row and _timed_out(request.app.state.settings, row):
+        row = _fail_timed_out(request, result_id) or row
+    return row
+
+
+async def aload_result(request: Request, result_id: str):
+    """load_result for async routes: the timeout writes run in a worker thread."""
+    row = request.app.state.repo.get_result(result_id)
+    if row and _timed_out(request.app.state.settings, row):
+        row = await asyncio.to_thread(_fail_timed_out, request, result_id) or row
+    return row
+
+
+def _timed_out(settings, row) -> bool:
+    if row.status != "processing":
+        return False
+    age_start = _parse_iso_datetime(row.started_at) or _parse_iso_datetime(row.created_at)
+    return bool(age_start) and datetime.now(timezone.utc) - age_start > timedelta(seconds=settings.processing_timeout_seconds)
+
+
+def _fail_timed_out(request: Request, result_id: str):
     repo = request.app.state.repo
-    settings = request.app.state.settings
-    row = repo.get_result(result_id)
+    if repo.mark_failed(result_id, "Timed out. Please try again.", internal_error_code="TIMED_OUT"):
+        # Drop the queued job too, so it stops counting against GEN_MAX_QUEUE and is never run.
+        repo.complete_job(result_id)
+        if request.app.state.dispatcher is not None:
+            request.app.state.dispatcher.discard(result_id)
+        request.app.state.notifier.publish(result_id)
+    return repo.get_result(result_id)
+
+
+@router.get("/selfie/result/{result_id}")
+async def get_result(request: Request, result_id: str) -> Response:
+    row = await aload_result(request, result_id)
     if not row:
         raise HTTPException(status_code=404, detail="Result not found")
-    if row.status == "processing":
-        age_start = _parse_iso_datetime(row.started_at) or _parse_iso_datetime(row.created_at)
-        if age_start:
-            if datetime.now(timezone.utc) - age_start > timedelta(seconds=settings.processing_timeout_seconds):
-                repo.mark_failed(result_id, "Timed out. Please try again.", internal_error_code="TIMED_OUT")
-                row = repo.get_result(result_id) or row
-    return _build_result_payload(request, row)
+    payload = build_result_payload(request, row)
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    headers = {
+        "ETag": strong_etag(body),
+        "Cache-Control": result_cache_control(payload["status"], payload["expires_at"]),
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/selfie/result/{result_id}/events")
+async def result_events(request: Request, result_id: str):
+    """
+    Server-Sent Events stream of result payloads. Emits the current state, then
+    each change, and closes once the result is no longer processing.
+    """
+    if not await aload_result(request, result_id):
+        raise HTTPException(status_code=404, detail="Result not found")
+    notifier = request.app.state.notifier
+    deadline = time.monotonic() + request.app.state.settings.processing_timeout_seconds
+
+    async def stream():
+        last = None
+        yield f"retry: {RETRY_AFTER_SECONDS * 1000}\n\n"
+        while True:
+            # Listen before reading so a change between the read and the wait is not missed.
+            changed = notifier.listen(result_id)
+            try:
+                row = await aload_result(request, result_id)
+                if not row:
+                    return
+                payload = build_result_payload(request, row)
+                if payload != last:
+                    yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+                    last = payload
+                if payload["status"] != "processing" or time.monotonic() > deadline:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), EVENTS_RECHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+            finally:
+                notifier.unlisten(result_id, changed)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _signed_redirect(settings, row, signed_url: str) -> RedirectResponse:
+    # Storage hands out the same signed URL while at least this much of its lifetime
+    # is left, so the redirect itself can be cached that long (but not past expiry).
+    url_lifetime = int(settings.s3_signed_url_ttl_seconds * settings.s3_presign_min_remaining)
+    remaining = int((datetime.fromisoformat(row.expires_at) - datetime.now(timezone.utc)).total_seconds())
+    max_age = max(0, min(url_lifetime, remaining))
+    return RedirectResponse(url=signed_url, status_code=307, headers={"Cache-Control": f"public, max-age={max_age}"})
 
 
 @router.get("/selfie/result/{result_id}/download")
@@ -268,13 +386,13 @@ async def download_result(request: Request, result_id: str):
     signed_url = storage.presigned_get_url(
         row.final_object_key,
         expires_in=settings.s3_signed_url_ttl_seconds,
-        download_filename=f"flames-selfie-{result_id}.png",
+        download_filename=f"flames-selfie-{result_id}{Path(row.final_object_key).suffix or '.png'}",
     )
-    return RedirectResponse(url=signed_url, status_code=307)
+    return _signed_redirect(settings, row, signed_url)
 
 
 @router.get("/selfie/result/{result_id}/image")
-async def image_result(request: Request, result_id: str):
+async def image_result(request: Request, result_id: str, variant: str = "full"):
     repo = request.app.state.repo
     storage = request.app.state.storage
     settings = request.app.state.settings
@@ -287,8 +405,15 @@ async def image_result(request: Request, result_id: str):
         raise HTTPException(status_code=410, detail="Result link has expired")
     if row.status != "ready" or not row.final_object_key:
         raise HTTPException(status_code=409, detail="Result not ready")
+    variants = {
+        "full": row.final_object_key,
+        "thumbnail": row.thumbnail_object_key,
+        "card": row.social_card_object_key,
+    }
+    if not variants.get(variant):
+        raise HTTPException(status_code=404, detail="Image variant not found")
     signed_url = storage.presigned_get_url(
-        row.final_object_key,
+        variants[variant],
         expires_in=settings.s3_signed_url_ttl_seconds,
     )
-    return RedirectResponse(url=signed_url, status_code=307)
+    return _signed_redirect(settings, row, signed_url)
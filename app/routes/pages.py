@@ -1,9 +1,28 @@
+import hashlib
+import json
+from functools import lru_cache
+from pathlib import Path
+
 from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 
+from app.routes.api import build_result_payload, load_result
+from app.services.http_cache import etag_matches, result_cache_control, strong_etag
+
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+TEMPLATE_DIR = "app/templates"
+SHARE_TEMPLATES = ("share.html", "_header.html", "_footer.html")
+templates = Jinja2Templates(directory=TEMPLATE_DIR)
+
+
+@lru_cache(maxsize=None)
+def _template_digest(names: tuple[str, ...]) -> str:
+    """Folded into page ETags so a deploy with changed markup invalidates cached copies."""
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update((Path(TEMPLATE_DIR) / name).read_bytes())
+    return digest.hexdigest()
 
 
 @router.get("/", response_class=HTMLResponse)
@@ -13,8 +32,20 @@ def home(request: Request):
 
 @router.get("/r/{result_id}", response_class=HTMLResponse)
 def shared_result(request: Request, result_id: str):
+    # The result is embedded in the page (image, download link, OG tags), so a ready
+    # share costs one cacheable response instead of page + status call + image lookup.
+    row = load_result(request, result_id)
+    result = build_result_payload(request, row) if row else None
+    fingerprint = json.dumps([_template_digest(SHARE_TEMPLATES), result_id, result], sort_keys=True)
+    headers = {
+        "ETag": strong_etag(fingerprint.encode("utf-8")),
+        "Cache-Control": result_cache_control(result and result["status"], result and result["expires_at"]),
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
     return templates.TemplateResponse(
         request,
         "share.html",
-        {"result_id": result_id},
+        {"result_id": result_id, "result": result},
+        headers=headers,
     )
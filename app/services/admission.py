@@ -0,0 +1,155 @@
+import asyncio
+import itertools
+import threading
+import time
+import uuid
+from typing import Callable
+
+from app.services.ownership import owner_alive
+from app.services.ratelimit import open_shared_state_db
+
+SLOT_POLL_SECONDS = 0.05
+MAX_SLOT_POLL_SECONDS = 1.0
+
+
+class InProcessSlots:
+    """
+    Up to `limit` concurrent holders within one process: try_acquire() fails fast,
+    acquire() waits for a release.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self._tokens = itertools.count(1)
+        self._held = 0
+
+    def __len__(self) -> int:
+        return self._held
+
+    async def try_acquire(self) -> str | None:
+        if self._semaphore.locked():
+            return None
+        # Does not suspend while the semaphore has capacity, so the check above holds.
+        return await self.acquire()
+
+    async def acquire(self) -> str:
+        await self._semaphore.acquire()
+        self._held += 1
+        return str(next(self._tokens))
+
+    async def release(self, token: str) -> None:
+        self._held -= 1
+        self._semaphore.release()
+
+    def close(self) -> None:
+        return None
+
+
+class SqliteSlots:
+    """
+    Slot rows in the shared state database, so the limit holds across every worker
+    process on the host. Each row records its holder's worker_identity(); when the
+    limit is reached, slots whose holder process no longer exists are reclaimed by
+    the acquirer. A live holder keeps its slot however long its job runs. Waiters
+    poll with backoff; jobs take seconds, so a few tens of milliseconds of wake-up
+    latency do not matter. Each transaction runs on a thread: it costs tens of
+    microseconds uncontended but can wait up to BUSY_TIMEOUT_SECONDS for the
+    write lock, which must not stall the event loop.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        name: str,
+        limit: int,
+        owner: str,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.name = name
+        self.limit = limit
+        self.owner = owner
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = open_shared_state_db(db_path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS admission_slots (
+                token TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                acquired_at REAL NOT NULL,
+                owner TEXT NOT NULL DEFAULT ''
+            ) WITHOUT ROWID
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(admission_slots)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE admission_slots ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        # Rows from before holders were recorded cannot be checked for liveness.
+        self._conn.execute("DELETE FROM admission_slots WHERE owner = ''")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_admission_slots_name_acquired ON admission_slots(name, acquired_at)"
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM admission_slots WHERE name = ?", (self.name,)).fetchone()[0]
+
+    async def try_acquire(self) -> str | None:
+        return await asyncio.to_thread(self._try_acquire)
+
+    async def acquire(self) -> str:
+        delay = SLOT_POLL_SECONDS
+        while True:
+            token = await asyncio.to_thread(self._try_acquire)
+            if token is not None:
+                return token
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_SLOT_POLL_SECONDS)
+
+    async def release(self, token: str) -> None:
+        await asyncio.to_thread(self._release, token)
+
+    def _release(self, token: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM admission_slots WHERE token = ?", (token,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _try_acquire(self) -> str | None:
+        now = self._clock()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                held = self._held(conn)
+                if held >= self.limit:
+                    held -= self._reclaim_dead(conn)
+                token = None
+                if held < self.limit:
+                    token = uuid.uuid4().hex
+                    conn.execute(
+                        "INSERT INTO admission_slots (token, name, acquired_at, owner) VALUES (?, ?, ?, ?)",
+                        (token, self.name, now, self.owner),
+                    )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return token
+
+    def _held(self, conn) -> int:
+        return conn.execute("SELECT COUNT(*) FROM admission_slots WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def _reclaim_dead(self, conn) -> int:
+        """Delete slots held by processes that died without releasing them; returns how many."""
+        owners = [row[0] for row in conn.execute("SELECT DISTINCT owner FROM admission_slots WHERE name = ?", (self.name,))]
+        reclaimed = 0
+        for owner in owners:
+            if not owner_alive(owner, self.owner):
+                reclaimed += conn.execute(
+                    "DELETE FROM admission_slots WHERE name = ? AND owner = ?", (self.name, owner)
+                ).rowcount
+        return reclaimed
@@ -1,30 +1,101 @@
 import asyncio
 import logging
+import time
 
-from app.services.results_repo import ResultsRepository, utc_now_iso
-from app.services.storage import S3Storage
+from app.services.results_repo import ResultsRepository, SelfieResult, utc_now_iso
+from app.services.storage import MAX_DELETE_BATCH, LocalStorage, S3Storage
 
 logger = logging.getLogger(__name__)
 
+DELETE_CONCURRENCY = 4
+EXPIRY_PAGE_SIZE = 500
 
-async def delete_expired_results_once(repo: ResultsRepository, storage: S3Storage) -> int:
-    expired = repo.get_expired_results(utc_now_iso())
-    if not expired:
-        return 0
 
-    for row in expired:
-        for key in (row.upload_object_key, row.generated_object_key, row.final_object_key):
+async def _delete_keys(storage: S3Storage | LocalStorage, keys: list[str]) -> set[str]:
+    semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+    async def delete_batch(batch: list[str]) -> set[str]:
+        async with semaphore:
             try:
-                if key:
-                    storage.delete_object(key)
+                return await storage.delete_objects(batch)
             except Exception:
-                logger.exception("Failed deleting object '%s'", key)
+                logger.exception("Failed deleting batch of %d objects", len(batch))
+                return set()
+
+    batches = [keys[i : i + MAX_DELETE_BATCH] for i in range(0, len(keys), MAX_DELETE_BATCH)]
+    deleted: set[str] = set()
+    for confirmed in await asyncio.gather(*(delete_batch(batch) for batch in batches)):
+        deleted |= confirmed
+    return deleted
+
+
+async def _sweep_page(repo: ResultsRepository, storage: S3Storage | LocalStorage, page: list[SelfieResult]) -> tuple[int, int, int]:
+    keys_by_row = {
+        row.id: [
+            key
+            for key in (
+                row.upload_object_key,
+                row.generated_object_key,
+                row.final_object_key,
+                row.thumbnail_object_key,
+                row.social_card_object_key,
+            )
+            if key
+        ]
+        for row in page
+    }
+    keys = [key for row_keys in keys_by_row.values() for key in row_keys]
+    deleted = await _delete_keys(storage, keys)
+
+    # Rows whose objects were not all confirmed deleted are kept and retried next sweep.
+    removable = [row_id for row_id, row_keys in keys_by_row.items() if all(key in deleted for key in row_keys)]
+    await asyncio.to_thread(repo.delete_results, removable)
+    return len(removable), len(keys), len(deleted)
+
+
+async def delete_expired_results_once(
+    repo: ResultsRepository,
+    storage: S3Storage | LocalStorage,
+    page_size: int = EXPIRY_PAGE_SIZE,
+) -> int:
+    """
+    Sweep expired rows in keyset pages, committing each page before fetching the next.
+    Memory stays flat regardless of backlog, and an interrupted sweep simply resumes
+    from whatever rows remain on the next run.
+    """
+    started = time.perf_counter()
+    now_iso = utc_now_iso()
+    cursor: tuple[str, str] | None = None
+    rows = removed = objects = deleted = 0
+
+    while True:
+        page = await asyncio.to_thread(repo.get_expired_results_page, now_iso, page_size, cursor)
+        if not page:
+            break
+        cursor = (page[-1].expires_at, page[-1].id)
+        page_removed, page_objects, page_deleted = await _sweep_page(repo, storage, page)
+        rows += len(page)
+        removed += page_removed
+        objects += page_objects
+        deleted += page_deleted
+        if len(page) < page_size:
+            break
 
-    repo.delete_results([row.id for row in expired])
-    return len(expired)
+    if rows:
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "cleanup_sweep rows=%d removed=%d objects=%d deleted=%d seconds=%.3f objects_per_sec=%.1f",
+            rows,
+            removed,
+            objects,
+            deleted,
+            elapsed,
+            deleted / elapsed if elapsed > 0 else 0.0,
+        )
+    return removed
 
 
-async def cleanup_loop(repo: ResultsRepository, storage: S3Storage, interval_seconds: int = 86400) -> None:
+async def cleanup_loop(repo: ResultsRepository, storage: S3Storage | LocalStorage, interval_seconds: int = 86400) -> None:
     while True:
         try:
             count = await delete_expired_results_once(repo, storage)
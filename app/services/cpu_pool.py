@@ -0,0 +1,29 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from app.services.image_pipeline import warm_frame_cache
+
+
+def create_cpu_pool(workers: int, frame_path: str) -> ProcessPoolExecutor | None:
+    """
+    Process pool for the CPU-heavy image stages (decode, resize, composite, encode).
+    Returns None when disabled, in which case stages run on a thread instead.
+    """
+    if workers <= 0:
+        return None
+    # "spawn" avoids forking a process that already has event-loop and boto3 threads.
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_frame_cache,
+        initargs=(frame_path,),
+    )
+
+
+async def run_cpu(pool: ProcessPoolExecutor | None, fn: Callable[..., Any], *args: Any) -> Any:
+    if pool is None:
+        return await asyncio.to_thread(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, fn, *args)
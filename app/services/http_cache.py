@@ -0,0 +1,35 @@
+import hashlib
+from datetime import datetime, timezone
+
+# Upper bound on how long browsers and edges may reuse a ready result, so a
+# takedown or changed delivery URL propagates within the hour.
+READY_MAX_AGE_SECONDS = 3600
+# Expired results never come back; the row is only ever deleted.
+EXPIRED_MAX_AGE_SECONDS = 86400
+
+
+def strong_etag(data: bytes) -> str:
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match check; weak validators compare equal under the weak comparison it calls for."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+
+def result_cache_control(status: str | None, expires_at: str | None, now: datetime | None = None) -> str:
+    """
+    Ready results are shared until they expire (capped at READY_MAX_AGE_SECONDS),
+    expired ones for a day; anything still changing must be revalidated.
+    """
+    if status == "ready" and expires_at:
+        now = now or datetime.now(timezone.utc)
+        remaining = int((datetime.fromisoformat(expires_at) - now).total_seconds())
+        return f"public, max-age={max(0, min(remaining, READY_MAX_AGE_SECONDS))}"
+    if status == "expired":
+        return f"public, max-age={EXPIRED_MAX_AGE_SECONDS}"
+    return "no-cache"
@@ -1,29 +1,78 @@
+import base64
 import io
-import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
+from urllib.parse import unquote_to_bytes
 
 import httpx
-from PIL import Image, ImageChops, ImageOps, ImageStat
+from PIL import Image, ImageFilter, ImageOps, ImageStat
 
 ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp"}
 MAX_UPLOAD_BYTES = 10 * 1024 * 1024
 MIN_DIMENSION = 512
+MIN_LUMA_VARIANCE = 8
+VALIDATION_DRAFT_SCALE = 8
 OUTPUT_SIZE = 1024
-_FRAME_CACHE: dict[str, tuple[float, Image.Image]] = {}
+THUMBNAIL_SIZE = 512
+SOCIAL_CARD_SIZE = (1200, 630)
+# The card's backdrop is blurred at 1/8 scale and stretched back up: ~20x cheaper than a full-size blur.
+SOCIAL_CARD_BACKDROP_SCALE = 8
+SOCIAL_CARD_BLUR_RADIUS = 3
+# Square frame sizes we composite at: full output, thumbnail, and the social card's height.
+FRAME_VARIANT_SIZES = (OUTPUT_SIZE, THUMBNAIL_SIZE, SOCIAL_CARD_SIZE[1])
+FRAME_CACHE_MAX_ENTRIES = 16
+# Level 3 is ~3x faster than zlib's default 6 for ~10% larger files on our frames.
+PNG_COMPRESS_LEVEL = 3
+WEBP_QUALITY = 85
+JPEG_QUALITY = 90
+# fal returns ~1-2 MB JPEGs; anything far larger is not an image we asked for.
+MAX_GENERATED_BYTES = 25 * 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 30.0
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    name: str
+    pil_format: str
+    extension: str
+    content_type: str
+
+
+OUTPUT_FORMATS = {
+    "png": OutputFormat("png", "PNG", "png", "image/png"),
+    "webp": OutputFormat("webp", "WEBP", "webp", "image/webp"),
+    "jpeg": OutputFormat("jpeg", "JPEG", "jpg", "image/jpeg"),
+}
+_PIL_FORMATS = {fmt.pil_format: fmt for fmt in OUTPUT_FORMATS.values()}
+
+
+@dataclass(frozen=True)
+class CampaignOutputs:
+    final: bytes
+    thumbnail: bytes
+    social_card: bytes
+
+
+THUMBNAIL_FORMAT = OUTPUT_FORMATS["webp"]
+SOCIAL_CARD_FORMAT = OUTPUT_FORMATS["jpeg"]
 
 
 class ValidationError(Exception):
     pass
 
 
-def validate_upload_bytes(data: bytes, mime_type: str | None) -> Image.Image:
+def validate_upload_bytes(data: bytes, mime_type: str | None) -> None:
     if mime_type not in ALLOWED_MIME_TYPES:
         raise ValidationError("Unsupported image format. Please upload JPG, PNG, or WebP.")
     if len(data) > MAX_UPLOAD_BYTES:
         raise ValidationError("Image is too large. Maximum size is 10MB.")
 
     try:
-        image = Image.open(io.BytesIO(data)).convert("RGB")
+        # Header only: format and dimensions are known before any pixel data is decoded.
+        image = Image.open(io.BytesIO(data))
     except Exception as exc:
         raise ValidationError("Invalid image file.") from exc
 
@@ -31,18 +80,65 @@ def validate_upload_bytes(data: bytes, mime_type: str | None) -> Image.Image:
         raise ValidationError("Image is too small. Minimum size is 512x512.")
 
     # Basic quality guard: reject near-flat images likely to be blank or unusable.
-    variance = ImageStat.Stat(image.convert("L")).var[0]
-    if variance < 8:
+    try:
+        variance, exact = _luma_variance(image, VALIDATION_DRAFT_SCALE)
+        if variance < MIN_LUMA_VARIANCE and not exact:
+            # A reduced decode averages pixels and can only under-report variance,
+            # so just the rare low reading needs confirming at full size.
+            variance, _ = _luma_variance(Image.open(io.BytesIO(data)), 1)
+    except Exception as exc:
+        raise ValidationError("Invalid image file.") from exc
+
+    if variance < MIN_LUMA_VARIANCE:
         raise ValidationError("Image quality is too low. Please try another photo.")
 
-    return image
+
+def _luma_variance(image: Image.Image, draft_scale: int) -> tuple[float, bool]:
+    """Return (variance, exact); JPEGs are decoded at 1/draft_scale via DCT scaling."""
+    reduced = False
+    if draft_scale > 1:
+        reduced = image.draft("RGB", (image.width // draft_scale, image.height // draft_scale)) is not None
+    variance = ImageStat.Stat(image.convert("RGB").convert("L")).var[0]
+    return variance, not reduced
 
 
-def download_generated_image(url: str) -> Image.Image:
-    with httpx.Client(timeout=30.0) as client:
-        response = client.get(url)
+def create_download_client(timeout: float = DOWNLOAD_TIMEOUT_SECONDS) -> httpx.AsyncClient:
+    """One per process: keeps connections to fal's CDN alive across jobs."""
+    return httpx.AsyncClient(timeout=timeout, follow_redirects=True)
+
+
+async def download_generated_bytes(
+    url: str,
+    client: httpx.AsyncClient | None = None,
+    max_bytes: int = MAX_GENERATED_BYTES,
+) -> bytes:
+    """
+    Stream the generated image into memory, refusing bodies over `max_bytes`
+    whether or not the server declares a Content-Length. Without a shared
+    `client` a one-off connection is opened.
+    """
+    if url.startswith("data:"):
+        # Inline results (the fake fal backend) carry the image in the URL itself.
+        header, _, payload = url.partition(",")
+        data = base64.b64decode(payload) if header.endswith(";base64") else unquote_to_bytes(payload)
+        if len(data) > max_bytes:
+            raise ValueError(f"Generated image exceeds {max_bytes} bytes")
+        return data
+    if client is None:
+        async with create_download_client() as one_off:
+            return await download_generated_bytes(url, one_off, max_bytes)
+
+    async with client.stream("GET", url) as response:
         response.raise_for_status()
-    return Image.open(io.BytesIO(response.content)).convert("RGB")
+        declared = response.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ValueError(f"Generated image exceeds {max_bytes} bytes")
+        buf = bytearray()
+        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+            buf += chunk
+            if len(buf) > max_bytes:
+                raise ValueError(f"Generated image exceeds {max_bytes} bytes")
+    return bytes(buf)
 
 
 def _center_crop_to_square(image: Image.Image) -> Image.Image:
@@ -58,75 +154,161 @@ def normalize_to_output_size(image: Image.Image) -> Image.Image:
 
 
 def apply_frame_overlay(image: Image.Image, frame_path: str) -> Image.Image:
-    frame = _load_frame(frame_path)
+    frame = _load_frame(frame_path, image.width)
     base = image.convert("RGBA")
     base.alpha_composite(frame)
     return base
 
 
-def build_final_campaign_image(generated: Image.Image, frame_path: str) -> bytes:
+def encode_image(image: Image.Image, output_format: str = "png") -> bytes:
+    fmt = OUTPUT_FORMATS[output_format]
+    buf = io.BytesIO()
+    if fmt.name == "png":
+        image.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    elif fmt.name == "webp":
+        image.convert("RGB").save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        image.convert("RGB").save(buf, format="JPEG", quality=JPEG_QUALITY, progressive=True, optimize=True)
+    return buf.getvalue()
+
+
+def detect_output_format(data: bytes) -> OutputFormat | None:
+    """Identify an encoded image from its header without decoding pixels."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return _PIL_FORMATS.get(image.format or "")
+    except Exception:
+        return None
+
+
+def build_social_card(normalized: Image.Image, frame_path: str) -> Image.Image:
+    """1200x630 link-preview card: the framed portrait centred on a blurred copy of itself."""
+    width, height = SOCIAL_CARD_SIZE
+    small = ImageOps.fit(
+        normalized.reduce(SOCIAL_CARD_BACKDROP_SCALE),
+        (width // SOCIAL_CARD_BACKDROP_SCALE, height // SOCIAL_CARD_BACKDROP_SCALE),
+    )
+    card = small.filter(ImageFilter.GaussianBlur(SOCIAL_CARD_BLUR_RADIUS)).resize(SOCIAL_CARD_SIZE, Image.Resampling.BILINEAR)
+    portrait = apply_frame_overlay(normalized.resize((height, height), Image.Resampling.LANCZOS), frame_path)
+    card.paste(portrait.convert("RGB"), ((width - height) // 2, 0))
+    return card
+
+
+def build_campaign_outputs(generated: Image.Image, frame_path: str, output_format: str = "png") -> CampaignOutputs:
+    """The final image plus its thumbnail and social card, all from one decode and normalize."""
     normalized = normalize_to_output_size(generated)
-    framed = apply_frame_overlay(normalized, frame_path)
+    # OUTPUT_SIZE is an exact multiple of THUMBNAIL_SIZE: a box reduce is ~15x faster than LANCZOS here.
+    thumbnail = apply_frame_overlay(normalized.reduce(OUTPUT_SIZE // THUMBNAIL_SIZE), frame_path)
+    return CampaignOutputs(
+        final=encode_image(apply_frame_overlay(normalized, frame_path), output_format),
+        thumbnail=encode_image(thumbnail, THUMBNAIL_FORMAT.name),
+        social_card=encode_image(build_social_card(normalized, frame_path), SOCIAL_CARD_FORMAT.name),
+    )
 
-    output = io.BytesIO()
-    framed.save(output, format="PNG")
-    return output.getvalue()
+
+def render_campaign_outputs(generated_bytes: bytes, frame_path: str, output_format: str = "png") -> CampaignOutputs:
+    """
+    Decode the generated image and return the encoded campaign outputs.
+    Takes plain bytes and returns a picklable result so it can run in a worker process.
+    """
+    generated = Image.open(io.BytesIO(generated_bytes)).convert("RGB")
+    return build_campaign_outputs(generated, frame_path, output_format)
+
+
+def campaign_frame_paths(frame_path: str) -> list[str]:
+    """The configured frame plus any sibling frame_*.png campaign variants."""
+    configured = Path(frame_path)
+    paths = {str(configured)}
+    if configured.parent.is_dir():
+        paths.update(str(p) for p in configured.parent.glob("frame_*.png"))
+    return sorted(paths)
 
 
-def _load_frame(frame_path: str) -> Image.Image:
+class FrameRegistry:
     """
-    Load and resize the frame overlay with alpha-safe resampling.
-    This avoids dark/incorrect edge halos when scaling transparent PNGs.
+    LRU cache of frame overlays resized to each square output size.
+    Entries are only refreshed by an explicit reload(), never by stat-ing files per job.
     """
-    key = f"{frame_path}:{OUTPUT_SIZE}"
-    try:
-        mtime = os.path.getmtime(frame_path)
-    except OSError:
-        mtime = 0.0
 
-    cached = _FRAME_CACHE.get(key)
-    if cached and cached[0] == mtime:
-        return cached[1]
+    def __init__(self, max_entries: int = FRAME_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._variants: OrderedDict[tuple[str, int], Image.Image] = OrderedDict()
+        self._preloaded: list[str] = []
+        self._lock = threading.Lock()
+
+    def preload(self, frame_paths: list[str], sizes: tuple[int, ...] = FRAME_VARIANT_SIZES) -> None:
+        self._preloaded = list(frame_paths)
+        for frame_path in frame_paths:
+            source = _open_frame(frame_path)
+            for size in sizes:
+                self._store((frame_path, size), _resize_frame(source, size))
+
+    def get(self, frame_path: str, size: int = OUTPUT_SIZE) -> Image.Image:
+        key = (frame_path, size)
+        with self._lock:
+            frame = self._variants.get(key)
+            if frame is not None:
+                self._variants.move_to_end(key)
+                return frame
+        frame = _resize_frame(_open_frame(frame_path), size)
+        self._store(key, frame)
+        return frame
+
+    def reload(self) -> None:
+        with self._lock:
+            self._variants.clear()
+        if self._preloaded:
+            self.preload(self._preloaded)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._variants.clear()
+            self._preloaded = []
+
+    def __len__(self) -> int:
+        return len(self._variants)
+
+    def _store(self, key: tuple[str, int], frame: Image.Image) -> None:
+        with self._lock:
+            self._variants[key] = frame
+            self._variants.move_to_end(key)
+            while len(self._variants) > self.max_entries:
+                self._variants.popitem(last=False)
+
 
-    frame = Image.open(Path(frame_path)).convert("RGBA")
-    target = (OUTPUT_SIZE, OUTPUT_SIZE)
-    if frame.size != target:
-        frame = _resize_rgba_premultiplied(frame, target, Image.Resampling.LANCZOS)
+_FRAME_REGISTRY = FrameRegistry()
 
-    _FRAME_CACHE[key] = (mtime, frame)
-    return frame
+
+def warm_frame_cache(frame_path: str) -> None:
+    _FRAME_REGISTRY.preload(campaign_frame_paths(frame_path))
+
+
+def reload_frame_assets() -> None:
+    _FRAME_REGISTRY.reload()
+
+
+def _load_frame(frame_path: str, size: int = OUTPUT_SIZE) -> Image.Image:
+    return _FRAME_REGISTRY.get(frame_path, size)
+
+
+def _open_frame(frame_path: str) -> Image.Image:
+    with Image.open(Path(frame_path)) as frame:
+        return frame.convert("RGBA")
+
+
+def _resize_frame(frame: Image.Image, size: int) -> Image.Image:
+    """
+    Resize the frame overlay with alpha-safe resampling.
+    This avoids dark/incorrect edge halos when scaling transparent PNGs.
+    """
+    target = (size, size)
+    if frame.size == target:
+        return frame
+    return _resize_rgba_premultiplied(frame, target, Image.Resampling.LANCZOS)
 
 
 def _resize_rgba_premultiplied(image: Image.Image, size: tuple[int, int], resample) -> Image.Image:
-    r, g, b, a = image.convert("RGBA").split()
-    rp = ImageChops.multiply(r, a)
-    gp = ImageChops.multiply(g, a)
-    bp = ImageChops.multiply(b, a)
-
-    rp = rp.resize(size, resample=resample)
-    gp = gp.resize(size, resample=resample)
-    bp = bp.resize(size, resample=resample)
-    a = a.resize(size, resample=resample)
-
-    # Un-premultiply (one-time cost per frame path/size due to caching).
-    rb = rp.tobytes()
-    gb = gp.tobytes()
-    bb = bp.tobytes()
-    ab = a.tobytes()
-    out_r = bytearray(len(ab))
-    out_g = bytearray(len(ab))
-    out_b = bytearray(len(ab))
-    for i, alpha in enumerate(ab):
-        if alpha == 0:
-            out_r[i] = 0
-            out_g[i] = 0
-            out_b[i] = 0
-        else:
-            out_r[i] = min(255, (rb[i] * 255) // alpha)
-            out_g[i] = min(255, (gb[i] * 255) // alpha)
-            out_b[i] = min(255, (bb[i] * 255) // alpha)
-
-    r2 = Image.frombytes("L", size, bytes(out_r))
-    g2 = Image.frombytes("L", size, bytes(out_g))
-    b2 = Image.frombytes("L", size, bytes(out_b))
-    return Image.merge("RGBA", (r2, g2, b2, a))
+    # "RGBa" is Pillow's premultiplied-alpha mode: the multiply, resample and
+    # un-premultiply all run in C, so transparent pixels never bleed colour into edges.
+    premultiplied = image.convert("RGBA").convert("RGBa")
+    return premultiplied.resize(size, resample=resample).convert("RGBA")
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+
+from app.services.job_runner import run_generation_job
+from app.services.ownership import owner_alive
+from app.services.results_repo import GenerationJob, ResultsRepository
+
+logger = logging.getLogger(__name__)
+
+# Fallback poll for work this process was not told about: retries coming due and
+# jobs enqueued by other processes.
+JOB_POLL_SECONDS = 1.0
+INTERRUPTED_MESSAGE = "Generation was interrupted. Please try again."
+
+
+def requeue_orphaned_jobs(repo: ResultsRepository, owner: str, max_attempts: int) -> tuple[int, int]:
+    """
+    Startup pass over the queue. Jobs held by a process that no longer exists are
+    resumed when their upload is in storage, and failed straight away when the only
+    copy of the upload died with that process. Processing results without a job
+    (e.g. from before the queue existed) are failed too. Returns (resumed, failed).
+    """
+    now = time.time()
+    resumed = failed = 0
+    for job in repo.list_jobs():
+        if job.lease_owner and job.lease_expires_at and job.lease_expires_at > now:
+            if owner_alive(job.lease_owner, owner):
+                continue
+        elif job.upload_stored or owner_alive(job.origin, owner):
+            # Still claimable by someone who can get at the upload.
+            continue
+
+        if job.upload_stored and job.attempts < max_attempts:
+            repo.retry_job(job.result_id, available_at=now, error="interrupted")
+            resumed += 1
+        else:
+            repo.mark_failed(job.result_id, INTERRUPTED_MESSAGE, internal_error_code="INTERRUPTED")
+            repo.complete_job(job.result_id)
+            failed += 1
+
+    failed += len(repo.fail_orphaned_results(INTERRUPTED_MESSAGE, "INTERRUPTED"))
+    if resumed or failed:
+        logger.info("job_queue_requeued resumed=%d failed=%d", resumed, failed)
+    return resumed, failed
+
+
+class JobDispatcher:
+    """
+    Claims jobs from the durable queue whenever a run slot is free and runs them in
+    this process. Upload bytes handed over by submit() stay in memory until the job
+    no longer needs them; jobs submitted elsewhere read theirs back from storage.
+    Bytes of jobs dropped without running here (timed out, or dropped by a claim)
+    are released by discard() or by the sweep on each pass.
+    """
+
+    def __init__(self, app, owner: str) -> None:
+        self.app = app
+        self.owner = owner
+        self._pending: dict[str, bytes] = {}
+        self._wake = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+        self._draining = False
+
+    def submit(self, result_id: str, photo_bytes: bytes) -> None:
+        self._pending[result_id] = photo_bytes
+        self._wake.set()
+
+    def discard(self, result_id: str) -> None:
+        """Release the upload bytes of a job that was dropped from the queue."""
+        self._pending.pop(result_id, None)
+
+    async def run(self) -> None:
+        try:
+            while not self._draining:
+                run_slots = self.app.state.gen_run_slots
+                token = await run_slots.acquire()
+                if self._draining:
+                    await run_slots.release(token)
+                    break
+                # Cleared before claiming so a submit() during the claim is not missed.
+                self._wake.clear()
+                try:
+                    await self._sweep_pending()
+                    job = await asyncio.to_thread(
+                        self.app.state.repo.claim_job,
+                        self.owner,
+                        time.time(),
+                        self.app.state.settings.processing_timeout_seconds,
+                    )
+                except Exception:
+                    logger.exception("job_claim_failed")
+                    job = None
+                if job is None:
+                    await run_slots.release(token)
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), JOB_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                task = asyncio.create_task(self._run(job, token))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def drain(self, timeout: float) -> None:
+        """Stop claiming and give running jobs up to `timeout` seconds to finish."""
+        self._draining = True
+        self._wake.set()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+    async def _run(self, job: GenerationJob, token: str) -> None:
+        try:
+            await run_generation_job(self.app, job, self._pending.get(job.result_id))
+        except Exception:
+            logger.exception("job_dispatch_failed result_id=%s", job.result_id)
+        finally:
+            await self.app.state.gen_run_slots.release(token)
+            await self._release_bytes(job.result_id)
+
+    async def _release_bytes(self, result_id: str) -> None:
+        """Keep a job's bytes only while it is still queued and this process is the sole holder of the upload."""
+        try:
+            job = await asyncio.to_thread(self.app.state.repo.get_job, result_id)
+        except Exception:
+            logger.exception("job_lookup_failed result_id=%s", result_id)
+            job = None
+        if job is None or job.upload_stored:
+            self._pending.pop(result_id, None)
+
+    async def _sweep_pending(self) -> None:
+        if self._pending:
+            # Only ids looked up here are swept; a submit() during the lookup is kept.
+            result_ids = list(self._pending)
+            queued = await asyncio.to_thread(self.app.state.repo.queued_job_ids, result_ids)
+            for result_id in set(result_ids) - queued:
+                self._pending.pop(result_id, None)
@@ -1,77 +1,237 @@
 import asyncio
-import io
+import hashlib
 import logging
+import time
 from datetime import datetime, timezone
-from pathlib import Path
-
-from PIL import Image
-
-from app.clients.fal_client import FalAPIClient
-from app.services.image_pipeline import build_final_campaign_image, download_generated_image
+from typing import Any, Awaitable
+
+from app.clients.fal_client import OUTPUT_FORMAT, ProgressCallback, create_fal_client
+from app.services.cpu_pool import run_cpu
+from app.services.image_pipeline import (
+    OUTPUT_FORMATS,
+    SOCIAL_CARD_FORMAT,
+    THUMBNAIL_FORMAT,
+    OutputFormat,
+    detect_output_format,
+    download_generated_bytes,
+    render_campaign_outputs,
+)
+from app.services.metrics import JOB_SECONDS, record, span
+from app.services.results_repo import GenerationJob
 
 logger = logging.getLogger(__name__)
 
-
-def _to_png_bytes(image: Image.Image) -> bytes:
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    return buf.getvalue()
+MAX_RETRY_BACKOFF_SECONDS = 300.0
+# Content-addressed final images never change under their key.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 
-async def run_generation_job(app, result_id: str, temp_path: str, extension: str, content_type: str) -> None:
+async def run_generation_job(app, job: GenerationJob, photo_bytes: bytes | None = None) -> bool:
+    """
+    Run one claimed job. `photo_bytes` is None when this process does not hold the
+    upload, which is then read back from storage. Returns True once the job is
+    finished (ready, or failed for good) and False when it was requeued for a retry.
+    Repository writes run in worker threads so SQLite never blocks the event loop.
+    """
     settings = app.state.settings
     repo = app.state.repo
     storage = app.state.storage
-    semaphore = app.state.gen_semaphore
+    result_id = job.result_id
+    timings: dict[str, float] = {}
+    job_started = time.perf_counter()
+    outcome = "failed"
 
-    await semaphore.acquire()
     try:
         started_at = datetime.now(timezone.utc).isoformat()
-        repo.mark_processing_started(result_id, started_at=started_at)
-        logger.info("job_started result_id=%s", result_id)
-
-        upload_key = f"selfies/{result_id}/upload.{extension}"
-        generated_key = f"selfies/{result_id}/generated.png"
-        final_key = f"selfies/{result_id}/final.png"
-
-        path = Path(temp_path)
-        try:
-            await asyncio.to_thread(_run_generation_sync, repo, storage, settings.frame_asset_path, path, content_type, upload_key, generated_key, final_key, result_id)
-            logger.info("job_finished result_id=%s", result_id)
-        finally:
-            path.unlink(missing_ok=True)
-    except Exception:
+        await asyncio.to_thread(repo.mark_processing_started, result_id, started_at=started_at)
+        logger.info("job_started result_id=%s attempt=%d", result_id, job.attempts)
+        # Since enqueue on the first attempt, since the retry came due after that.
+        record("queue_wait", max(0.0, time.time() - job.available_at), timings)
+
+        if photo_bytes is None:
+            with span("fetch_upload", timings):
+                photo_bytes = await storage.get_bytes(job.upload_object_key)
+        final_key = f"selfies/{result_id}/final.{OUTPUT_FORMATS[settings.final_image_format].extension}"
+
+        await _run_generation(
+            repo, storage, settings, photo_bytes, job.content_type, job.upload_object_key, final_key, result_id,
+            app.state.cpu_pool, upload_stored=job.upload_stored, fal=app.state.fal_client, http=app.state.http_client,
+            on_progress=_progress_reporter(repo, app.state.notifier, result_id), timings=timings,
+        )
+        logger.info(
+            "job_finished result_id=%s total=%.3f stages=%s",
+            result_id,
+            time.perf_counter() - job_started,
+            " ".join(f"{stage}={seconds:.3f}" for stage, seconds in timings.items()),
+        )
+        await asyncio.to_thread(repo.complete_job, result_id)
+        outcome = "ready"
+        return True
+    except Exception as exc:
+        if job.attempts < settings.gen_job_max_attempts:
+            outcome = "retried"
+            delay = _retry_delay(job.attempts, settings.gen_job_retry_backoff_seconds)
+            logger.exception("job_retry result_id=%s attempt=%d delay=%.1f", result_id, job.attempts, delay)
+            await asyncio.to_thread(repo.retry_job, result_id, available_at=time.time() + delay, error=repr(exc)[:500])
+            return False
         logger.exception("job_failed result_id=%s", result_id)
         try:
-            repo.mark_failed(result_id, "Generation failed. Please try again.", internal_error_code="GENERATION_FAILED")
+            await asyncio.to_thread(
+                repo.mark_failed, result_id, "Generation failed. Please try again.", internal_error_code="GENERATION_FAILED"
+            )
+            await asyncio.to_thread(repo.complete_job, result_id)
         except Exception:
             logger.exception("job_failed_mark_failed result_id=%s", result_id)
+        return True
     finally:
-        semaphore.release()
-        async with app.state.gen_inflight_lock:
-            app.state.gen_inflight = max(0, app.state.gen_inflight - 1)
-
-
-def _run_generation_sync(repo, storage, frame_asset_path: str, photo_path: Path, content_type: str, upload_key: str, generated_key: str, final_key: str, result_id: str) -> None:
-    with photo_path.open("rb") as f:
-        photo_bytes = f.read()
-    storage.upload_bytes(upload_key, photo_bytes, content_type or "application/octet-stream")
+        JOB_SECONDS.observe(outcome, time.perf_counter() - job_started)
+        try:
+            await asyncio.to_thread(repo.record_stage_timings, result_id, timings)
+        except Exception:
+            logger.exception("job_timings_failed result_id=%s", result_id)
+        app.state.notifier.publish(result_id)
 
-    fal_client = FalAPIClient()
-    generated_url = fal_client.generate_firefighter_image(photo_path)
 
-    generated_image = download_generated_image(generated_url)
-    generated_png = _to_png_bytes(generated_image)
-    storage.upload_bytes(generated_key, generated_png, "image/png")
+def _progress_reporter(repo, notifier, result_id: str) -> ProgressCallback:
+    """Persist fal progress on the result and wake its status streams, on change only."""
+    last: tuple[str, int | None] | None = None
 
-    final_bytes = build_final_campaign_image(generated_image, frame_asset_path)
-    public_url = storage.upload_bytes(final_key, final_bytes, "image/png")
+    async def report(stage: str, queue_position: int | None = None) -> None:
+        nonlocal last
+        if (stage, queue_position) == last:
+            return
+        last = (stage, queue_position)
+        try:
+            await asyncio.to_thread(repo.update_progress, result_id, stage, queue_position)
+        except Exception:
+            logger.exception("job_progress_failed result_id=%s", result_id)
+            return
+        notifier.publish(result_id)
+
+    return report
+
+
+def _retry_delay(attempts: int, base_seconds: float) -> float:
+    return min(base_seconds * 2 ** (attempts - 1), MAX_RETRY_BACKOFF_SECONDS)
+
+
+async def _timed(timings: dict[str, float], stage: str, awaitable: Awaitable[Any]) -> Any:
+    with span(stage, timings):
+        return await awaitable
+
+
+async def _run_generation(repo, storage, settings, photo_bytes: bytes, content_type: str, upload_key: str, final_key: str, result_id: str, cpu_pool=None, upload_stored: bool = False, fal=None, http=None, on_progress: ProgressCallback | None = None, timings: dict[str, float] | None = None) -> dict[str, float]:
+    """
+    Run one job, overlapping stages that do not depend on each other:
+    the S3 copy of the original alongside fal generation (unless fal reads that
+    copy, see FAL_SOURCE), and the generated-image PUT alongside compositing +
+    the final PUT. Returns seconds spent per stage, filling `timings` if given.
+    """
+    timings = {} if timings is None else timings
+    fal = fal or create_fal_client(settings)
+    fal_marks: dict[str, float] = {}
+
+    async def on_fal_progress(stage: str, queue_position: int | None = None) -> None:
+        if stage == "generating":
+            fal_marks.setdefault("generating", time.perf_counter())
+        if on_progress:
+            await on_progress(stage, queue_position)
+
+    async def generate(source_url: str | None = None) -> str:
+        with span("fal_generate", timings):
+            fal_marks["start"] = time.perf_counter()
+            url = await fal.generate_firefighter_image(photo_bytes, content_type, on_fal_progress, source_url)
+            fal_marks["end"] = time.perf_counter()
+        return url
+
+    async def store_original() -> None:
+        if upload_stored:
+            return
+        await _timed(timings, "upload_original", storage.upload_bytes(upload_key, photo_bytes, content_type or "application/octet-stream"))
+        # From here any worker can resume the job from storage.
+        await asyncio.to_thread(repo.mark_job_upload_stored, result_id)
+
+    if settings.fal_source == "storage":
+        # fal fetches the stored original itself, so the photo is uploaded once instead of twice.
+        await store_original()
+        source_url = storage.presigned_get_url(upload_key, expires_in=int(settings.fal_job_timeout_seconds))
+        generated_url = await generate(source_url)
+    else:
+        _, generated_url = await asyncio.gather(store_original(), generate())
+    if "generating" in fal_marks:
+        # Split fal's share of the job into waiting in its queue and running the model.
+        record("fal_queue", fal_marks["generating"] - fal_marks["start"], timings)
+        record("fal_inference", fal_marks["end"] - fal_marks["generating"], timings)
+    if on_progress:
+        await on_progress("finishing")
+
+    # Keep fal's encoded bytes as the generated artifact rather than re-encoding them.
+    generated_bytes = await _timed(timings, "download_generated", download_generated_bytes(generated_url, http))
+    download_seconds = timings["download_generated"]
+    logger.info(
+        "generated_downloaded result_id=%s bytes=%d seconds=%.3f mib_per_s=%.2f",
+        result_id,
+        len(generated_bytes),
+        download_seconds,
+        len(generated_bytes) / 1048576 / download_seconds if download_seconds > 0 else 0.0,
+    )
+    generated_format = detect_output_format(generated_bytes)
+    generated_type = generated_format.content_type if generated_format else "application/octet-stream"
+    # Named after what fal actually returned, which need not be the OUTPUT_FORMAT asked for.
+    generated_key = f"selfies/{result_id}/generated.{(generated_format or OUTPUT_FORMATS[OUTPUT_FORMAT]).extension}"
+    final_format = OUTPUT_FORMATS[settings.final_image_format]
+
+    async def compose_and_upload_outputs() -> list[tuple[str, str]]:
+        outputs = await _timed(timings, "compose", run_cpu(cpu_pool, render_campaign_outputs, generated_bytes, settings.frame_asset_path, final_format.name))
+        return await _timed(
+            timings,
+            "upload_final",
+            asyncio.gather(
+                _store_output(storage, settings, final_key, outputs.final, final_format),
+                _store_output(storage, settings, f"selfies/{result_id}/thumb.{THUMBNAIL_FORMAT.extension}", outputs.thumbnail, THUMBNAIL_FORMAT),
+                _store_output(storage, settings, f"selfies/{result_id}/card.{SOCIAL_CARD_FORMAT.extension}", outputs.social_card, SOCIAL_CARD_FORMAT),
+            ),
+        )
+
+    _, stored = await asyncio.gather(
+        _timed(timings, "upload_generated", storage.upload_bytes(generated_key, generated_bytes, generated_type)),
+        compose_and_upload_outputs(),
+    )
+    (stored_final_key, public_url), (thumbnail_key, _), (social_card_key, _) = stored
 
-    repo.mark_ready(
+    ready = await asyncio.to_thread(
+        repo.mark_ready,
         result_id=result_id,
         upload_object_key=upload_key,
         generated_object_key=generated_key,
-        final_object_key=final_key,
+        final_object_key=stored_final_key,
         public_image_url=public_url,
+        thumbnail_object_key=thumbnail_key,
+        social_card_object_key=social_card_key,
     )
+    if not ready:
+        # Timed out (and already reported as failed) while this run was in flight. The
+        # failed row does not reference the outputs, so cleanup would never reach them;
+        # the original is no longer needed either.
+        logger.warning("job_superseded result_id=%s", result_id)
+        try:
+            await storage.delete_objects([upload_key, generated_key, stored_final_key, thumbnail_key, social_card_key])
+        except Exception:
+            logger.exception("job_superseded_cleanup_failed result_id=%s", result_id)
+    return timings
+
+
+async def _store_output(storage, settings, key: str, data: bytes, fmt: OutputFormat) -> tuple[str, str]:
+    """PUT one rendered output; returns the key it was stored under and its public URL."""
+    cache_control = None
+    if settings.image_delivery == "public":
+        # Browsers and the CDN load these URLs directly, so a key must never be reused for other bytes.
+        key, cache_control = _content_addressed_key(key, data), IMMUTABLE_CACHE_CONTROL
+    return key, await storage.upload_bytes(key, data, fmt.content_type, cache_control)
+
 
+def _content_addressed_key(key: str, data: bytes) -> str:
+    """selfies/{id}/final.png -> selfies/{id}/final-<sha256 prefix>.png"""
+    stem, dot, extension = key.rpartition(".")
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    return f"{stem}-{digest}.{extension}" if dot else f"{key}-{digest}"
@@ -0,0 +1,123 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+# Seconds; spans stages from a SQLite insert (~ms) up to a slow fal queue (minutes).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with one label, rendered in the Prometheus text
+    format. Values are per process; each worker exposes its own series.
+    """
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> (per-bucket counts with a final +Inf slot, sum)
+        self._series: dict[str, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def snapshot(self, label_value: str) -> tuple[int, float]:
+        """(count, sum) for one label value."""
+        with self._lock:
+            series = self._series.get(label_value)
+            return (sum(series[0]), series[1][0]) if series else (0, 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((value, list(counts), total[0]) for value, (counts, total) in self._series.items())
+        for value, counts, total in series:
+            label = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "selfie_stage_seconds",
+    "Seconds spent in each stage of a generation request or job.",
+    "stage",
+)
+JOB_SECONDS = Histogram(
+    "selfie_job_seconds",
+    "Seconds from job start to completion, by outcome.",
+    "outcome",
+)
+HISTOGRAMS = (STAGE_SECONDS, JOB_SECONDS)
+
+
+def record(stage: str, seconds: float, timings: dict[str, float] | None = None) -> None:
+    """Observe a stage measured elsewhere into STAGE_SECONDS and, if given, `timings`."""
+    STAGE_SECONDS.observe(stage, seconds)
+    if timings is not None:
+        timings[stage] = seconds
+
+
+@contextmanager
+def span(stage: str, timings: dict[str, float] | None = None) -> Iterator[None]:
+    """Time a block into STAGE_SECONDS and, if given, into a per-result `timings` dict."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started, timings)
+
+
+def state_metrics(state) -> tuple[dict[str, tuple[str, float]], dict[str, tuple[str, float]]]:
+    """(gauges, counters) read from an app's state; parts a process does not run are skipped."""
+    gauges: dict[str, tuple[str, float]] = {}
+    counters: dict[str, tuple[str, float]] = {}
+    repo = getattr(state, "repo", None)
+    if repo is not None:
+        gauges["selfie_jobs_queued"] = ("Generation jobs queued or running, across all processes.", repo.count_jobs())
+    run_slots = getattr(state, "gen_run_slots", None)
+    if run_slots is not None:
+        gauges["selfie_run_slots_in_use"] = ("Generation run slots held.", len(run_slots))
+    rate_limiter = getattr(state, "rate_limiter", None)
+    if rate_limiter is not None:
+        gauges["selfie_rate_limit_keys"] = ("Client IPs tracked by the rate limiter.", len(rate_limiter))
+    storage = getattr(state, "storage", None)
+    if hasattr(storage, "presign_hits"):
+        counters["selfie_presign_cache_hits_total"] = ("Presigned URLs served from cache.", storage.presign_hits)
+        counters["selfie_presign_cache_misses_total"] = ("Presigned URLs signed.", storage.presign_misses)
+    return gauges, counters
+
+
+def render_prometheus(
+    gauges: dict[str, tuple[str, float]] | None = None,
+    counters: dict[str, tuple[str, float]] | None = None,
+) -> str:
+    """All histograms plus gauges and counters given as {name: (help, value)}."""
+    lines: list[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for kind, values in (("gauge", gauges), ("counter", counters)):
+        for name, (help_text, value) in sorted((values or {}).items()):
+            lines.extend((f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value:g}"))
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
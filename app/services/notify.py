@@ -0,0 +1,39 @@
+import asyncio
+
+
+class ResultNotifier:
+    """
+    In-process hub that wakes status streams when a result changes.
+    publish() may be called from any thread; listeners live on the app's event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._listeners: dict[str, set[asyncio.Event]] = {}
+
+    def listen(self, result_id: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self._listeners.setdefault(result_id, set()).add(event)
+        return event
+
+    def unlisten(self, result_id: str, event: asyncio.Event) -> None:
+        listeners = self._listeners.get(result_id)
+        if listeners is None:
+            return
+        listeners.discard(event)
+        if not listeners:
+            del self._listeners[result_id]
+
+    def publish(self, result_id: str) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake(result_id)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake, result_id)
+
+    def _wake(self, result_id: str) -> None:
+        for event in self._listeners.get(result_id, ()):
+            event.set()
@@ -0,0 +1,32 @@
+import os
+import socket
+import uuid
+
+
+def worker_identity() -> str:
+    """host:pid:nonce; the nonce tells this process apart from an earlier one with the same pid."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def owner_alive(owner: str, self_owner: str) -> bool:
+    """Whether the process behind a worker_identity() may still be running."""
+    if owner == self_owner:
+        return True
+    host, _, rest = owner.partition(":")
+    if host != socket.gethostname():
+        # Can't see another host's processes; its lease expiry covers it.
+        return True
+    try:
+        pid = int(rest.split(":", 1)[0])
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        # Same pid but a different nonce: a previous incarnation of this process.
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.services.results_repo import ResultsRepository, SelfieResult
+
+TERMINAL_STATUSES = {"ready", "failed"}
+
+
+class ResultCache:
+    """
+    Bounded LRU of result rows with per-entry TTLs. Terminal rows rarely change and
+    get the long TTL; processing rows get a short one so writes from other processes
+    become visible quickly.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, processing_ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.processing_ttl_seconds = processing_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, SelfieResult]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, result_id: str) -> SelfieResult | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[result_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(result_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, row: SelfieResult) -> None:
+        ttl = self.ttl_seconds if row.status in TERMINAL_STATUSES else self.processing_ttl_seconds
+        with self._lock:
+            self._entries[row.id] = (time.monotonic() + ttl, row)
+            self._entries.move_to_end(row.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, result_id: str) -> None:
+        with self._lock:
+            self._entries.pop(result_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachedResultsRepository(ResultsRepository):
+    """
+    ResultsRepository that serves get_result from a ResultCache. Every status
+    transition writes through to SQLite first and then refreshes the cached row,
+    so in-process polls see job updates immediately.
+    """
+
+    def __init__(self, db_path: str, cache: ResultCache, pooled: bool = True) -> None:
+        super().__init__(db_path, pooled=pooled)
+        self.cache = cache
+
+    def _refresh(self, result_id: str) -> None:
+        row = super().get_result(result_id)
+        if row:
+            self.cache.put(row)
+        else:
+            self.cache.invalidate(result_id)
+
+    def get_result(self, result_id: str) -> SelfieResult | None:
+        row = self.cache.get(result_id)
+        if row is not None:
+            return row
+        row = super().get_result(result_id)
+        if row:
+            self.cache.put(row)
+        return row
+
+    def create_processing_result(self, result_id: str, *args, **kwargs) -> None:
+        super().create_processing_result(result_id, *args, **kwargs)
+        self._refresh(result_id)
+
+    def create_queued_result(self, result_id: str, *args, **kwargs) -> bool:
+        queued = super().create_queued_result(result_id, *args, **kwargs)
+        if queued:
+            self._refresh(result_id)
+        return queued
+
+    def fail_orphaned_results(self, *args, **kwargs) -> list[str]:
+        result_ids = super().fail_orphaned_results(*args, **kwargs)
+        for result_id in result_ids:
+            self.cache.invalidate(result_id)
+        return result_ids
+
+    def mark_processing_started(self, result_id: str, started_at: str) -> None:
+        super().mark_processing_started(result_id, started_at)
+        self._refresh(result_id)
+
+    def update_progress(self, result_id: str, *args, **kwargs) -> None:
+        super().update_progress(result_id, *args, **kwargs)
+        self._refresh(result_id)
+
+    def record_stage_timings(self, result_id: str, timings: dict[str, float]) -> None:
+        super().record_stage_timings(result_id, timings)
+        self._refresh(result_id)
+
+    def mark_ready(self, result_id: str, *args, **kwargs) -> bool:
+        ready = super().mark_ready(result_id, *args, **kwargs)
+        self._refresh(result_id)
+        return ready
+
+    def mark_failed(self, result_id: str, *args, **kwargs) -> bool:
+        failed = super().mark_failed(result_id, *args, **kwargs)
+        self._refresh(result_id)
+        return failed
+
+    def delete_results(self, result_ids: list[str]) -> None:
+        super().delete_results(result_ids)
+        for result_id in result_ids:
+            self.cache.invalidate(result_id)
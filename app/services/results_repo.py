@@ -1,9 +1,15 @@
+import json
 import sqlite3
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, fields
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Iterable
 
+DELETE_CHUNK_SIZE = 500
+BUSY_TIMEOUT_SECONDS = 5.0
+STATEMENT_CACHE_SIZE = 256
+
 
 @dataclass
 class SelfieResult:
@@ -23,18 +29,90 @@ class SelfieResult:
     client_request_id: str | None
     ip_hash: str | None
     started_at: str | None
+    progress_stage: str | None
+    queue_position: int | None
+    thumbnail_object_key: str | None
+    social_card_object_key: str | None
+    stage_timings: str | None
+
+
+@dataclass
+class GenerationJob:
+    result_id: str
+    upload_object_key: str
+    content_type: str
+    upload_stored: bool
+    attempts: int
+    available_at: float
+    origin: str
+    lease_owner: str | None
+    lease_expires_at: float | None
+    last_error: str | None
+
+
+# Explicit column list so rows map positionally onto SelfieResult, whatever the
+# physical column order of a migrated table.
+_RESULT_COLUMNS = ", ".join(f.name for f in fields(SelfieResult))
+_JOB_COLUMNS = ", ".join(f.name for f in fields(GenerationJob))
+
+_INSERT_PROCESSING_RESULT = """
+    INSERT INTO selfie_results (
+        id, created_at, expires_at, status, prompt_version,
+        moderation_status, user_agent_hash, client_request_id, ip_hash
+    ) VALUES (?, ?, ?, 'processing', ?, 'passed', ?, ?, ?)
+"""
+
+
+def _job(row) -> GenerationJob:
+    job = GenerationJob(*row)
+    job.upload_stored = bool(job.upload_stored)
+    return job
 
 
 class ResultsRepository:
-    def __init__(self, db_path: str) -> None:
+    """
+    With `pooled` (the default) each thread reuses one WAL-mode connection, so the
+    statement cache stays warm and readers never block on the writer. `pooled=False`
+    keeps the original connection-per-call behaviour.
+    """
+
+    def __init__(self, db_path: str, pooled: bool = True) -> None:
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.pooled = pooled
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
 
     def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        if not self.pooled:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=BUSY_TIMEOUT_SECONDS,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
         return conn
 
+    def close(self) -> None:
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
     def init_db(self) -> None:
         with self._connect() as conn:
             version = conn.execute("PRAGMA user_version").fetchone()[0]
@@ -56,7 +134,12 @@ class ResultsRepository:
                     user_agent_hash TEXT,
                     client_request_id TEXT,
                     ip_hash TEXT,
-                    started_at TEXT
+                    started_at TEXT,
+                    progress_stage TEXT,
+                    queue_position INTEGER,
+                    thumbnail_object_key TEXT,
+                    social_card_object_key TEXT,
+                    stage_timings TEXT
                 )
                 """
             )
@@ -70,6 +153,11 @@ class ResultsRepository:
                 ("client_request_id", "TEXT"),
                 ("ip_hash", "TEXT"),
                 ("started_at", "TEXT"),
+                ("progress_stage", "TEXT"),
+                ("queue_position", "INTEGER"),
+                ("thumbnail_object_key", "TEXT"),
+                ("social_card_object_key", "TEXT"),
+                ("stage_timings", "TEXT"),
             ):
                 if name not in existing_cols:
                     conn.execute(f"ALTER TABLE selfie_results ADD COLUMN {name} {col_type}")
@@ -78,6 +166,26 @@ class ResultsRepository:
             conn.execute(
                 "CREATE UNIQUE INDEX IF NOT EXISTS idx_selfie_results_client_req_ip ON selfie_results(client_request_id, ip_hash)"
             )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_selfie_results_status ON selfie_results(status)")
+            # Durable generation queue: one row per job until it is ready or failed for good.
+            # `origin` is the process holding the upload bytes in memory until upload_stored.
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS generation_jobs (
+                    result_id TEXT PRIMARY KEY,
+                    upload_object_key TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    upload_stored INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    origin TEXT NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    last_error TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_available_at ON generation_jobs(available_at)")
             if version < 1:
                 # Older DBs (created before user_version existed) will already have the columns due to CREATE TABLE.
                 conn.execute("PRAGMA user_version = 1")
@@ -94,35 +202,209 @@ class ResultsRepository:
         ip_hash: str | None,
     ) -> None:
         with self._connect() as conn:
+            conn.execute(
+                _INSERT_PROCESSING_RESULT,
+                (result_id, created_at, expires_at, prompt_version, user_agent_hash, client_request_id, ip_hash),
+            )
+            conn.commit()
+
+    def create_queued_result(
+        self,
+        result_id: str,
+        created_at: str,
+        expires_at: str,
+        prompt_version: str,
+        user_agent_hash: str | None,
+        client_request_id: str | None,
+        ip_hash: str | None,
+        upload_object_key: str,
+        content_type: str,
+        origin: str,
+        max_queue: int,
+        now: float,
+        upload_stored: bool = False,
+    ) -> bool:
+        """
+        Insert a processing result and its queued job in one transaction, unless
+        `max_queue` jobs are already queued or running. Returns False when full.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            depth = conn.execute("SELECT COUNT(*) FROM generation_jobs").fetchone()[0]
+            if depth >= max_queue:
+                conn.rollback()
+                return False
+            conn.execute(
+                _INSERT_PROCESSING_RESULT,
+                (result_id, created_at, expires_at, prompt_version, user_agent_hash, client_request_id, ip_hash),
+            )
+            # Recorded up front so expiry cleanup reaches the stored original even when the
+            # result never becomes ready (failed, timed out, or its job was dropped).
+            conn.execute("UPDATE selfie_results SET upload_object_key = ? WHERE id = ?", (upload_object_key, result_id))
             conn.execute(
                 """
-                INSERT INTO selfie_results (
-                    id, created_at, expires_at, status, prompt_version,
-                    moderation_status, user_agent_hash, client_request_id, ip_hash
-                ) VALUES (?, ?, ?, 'processing', ?, 'passed', ?, ?, ?)
+                INSERT INTO generation_jobs (
+                    result_id, upload_object_key, content_type, upload_stored, available_at, origin
+                ) VALUES (?, ?, ?, ?, ?, ?)
                 """,
-                (result_id, created_at, expires_at, prompt_version, user_agent_hash, client_request_id, ip_hash),
+                (result_id, upload_object_key, content_type, int(upload_stored), now, origin),
+            )
+            conn.commit()
+        return True
+
+    def count_jobs(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM generation_jobs").fetchone()[0]
+
+    def get_job(self, result_id: str) -> GenerationJob | None:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {_JOB_COLUMNS} FROM generation_jobs WHERE result_id = ?", (result_id,)).fetchone()
+            return _job(row) if row else None
+
+    def queued_job_ids(self, result_ids: Iterable[str]) -> set[str]:
+        """The subset of `result_ids` that still have a queued or running job."""
+        result_ids = list(result_ids)
+        found: set[str] = set()
+        with self._connect() as conn:
+            for i in range(0, len(result_ids), DELETE_CHUNK_SIZE):
+                chunk = result_ids[i : i + DELETE_CHUNK_SIZE]
+                placeholders = ",".join("?" for _ in chunk)
+                found.update(
+                    row[0]
+                    for row in conn.execute(
+                        f"SELECT result_id FROM generation_jobs WHERE result_id IN ({placeholders})", chunk
+                    )
+                )
+        return found
+
+    def list_jobs(self) -> list[GenerationJob]:
+        # Bounded by GEN_MAX_QUEUE.
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {_JOB_COLUMNS} FROM generation_jobs ORDER BY available_at").fetchall()
+            return [_job(row) for row in rows]
+
+    def claim_job(self, owner: str, now: float, lease_seconds: float) -> GenerationJob | None:
+        """
+        Lease the oldest available job to `owner`. A job whose upload is not stored yet
+        can only be claimed by its origin, the one process holding the bytes. Jobs whose
+        result is no longer processing (timed out, or deleted) are dropped, not run.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    f"""
+                    SELECT {_JOB_COLUMNS}, (SELECT status FROM selfie_results WHERE id = result_id)
+                    FROM generation_jobs
+                    WHERE available_at <= ?
+                      AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+                      AND (upload_stored = 1 OR origin = ?)
+                    ORDER BY available_at
+                    LIMIT 1
+                    """,
+                    (now, now, owner),
+                ).fetchone()
+                if not row:
+                    # Keeps the deletes of any jobs dropped above.
+                    conn.commit()
+                    return None
+                job = _job(row[:-1])
+                if row[-1] == "processing":
+                    break
+                conn.execute("DELETE FROM generation_jobs WHERE result_id = ?", (job.result_id,))
+            job.attempts += 1
+            job.lease_owner = owner
+            job.lease_expires_at = now + lease_seconds
+            conn.execute(
+                "UPDATE generation_jobs SET attempts = ?, lease_owner = ?, lease_expires_at = ? WHERE result_id = ?",
+                (job.attempts, job.lease_owner, job.lease_expires_at, job.result_id),
             )
             conn.commit()
+            return job
+
+    def mark_job_upload_stored(self, result_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE generation_jobs SET upload_stored = 1 WHERE result_id = ?", (result_id,))
+            conn.commit()
+
+    def retry_job(self, result_id: str, available_at: float, error: str | None = None) -> None:
+        """Release the lease and make the job claimable again from `available_at`."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE generation_jobs
+                SET available_at = ?, lease_owner = NULL, lease_expires_at = NULL, last_error = ?
+                WHERE result_id = ?
+                """,
+                (available_at, error, result_id),
+            )
+            conn.commit()
+
+    def complete_job(self, result_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM generation_jobs WHERE result_id = ?", (result_id,))
+            conn.commit()
+
+    def fail_orphaned_results(self, error_message: str, internal_error_code: str) -> list[str]:
+        """Fail processing results that no longer have a queued job; returns their ids."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [
+                row[0]
+                for row in conn.execute(
+                    """
+                    SELECT id FROM selfie_results
+                    WHERE status = 'processing'
+                      AND id NOT IN (SELECT result_id FROM generation_jobs)
+                    """
+                ).fetchall()
+            ]
+            for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+                chunk = ids[i : i + DELETE_CHUNK_SIZE]
+                placeholders = ",".join("?" for _ in chunk)
+                conn.execute(
+                    f"""
+                    UPDATE selfie_results SET status = 'failed', error_message = ?, internal_error_code = ?
+                    WHERE id IN ({placeholders})
+                    """,
+                    (error_message, internal_error_code, *chunk),
+                )
+            conn.commit()
+            return ids
 
     def get_by_client_request_id(self, ip_hash: str, client_request_id: str) -> SelfieResult | None:
         with self._connect() as conn:
             row = conn.execute(
-                "SELECT * FROM selfie_results WHERE ip_hash = ? AND client_request_id = ?",
+                f"SELECT {_RESULT_COLUMNS} FROM selfie_results WHERE ip_hash = ? AND client_request_id = ?",
                 (ip_hash, client_request_id),
             ).fetchone()
             if not row:
                 return None
-            return SelfieResult(**dict(row))
+            return SelfieResult(*row)
 
     def mark_processing_started(self, result_id: str, started_at: str) -> None:
         with self._connect() as conn:
             conn.execute(
-                "UPDATE selfie_results SET started_at = ? WHERE id = ?",
+                "UPDATE selfie_results SET started_at = ?, progress_stage = NULL, queue_position = NULL WHERE id = ?",
                 (started_at, result_id),
             )
             conn.commit()
 
+    def update_progress(self, result_id: str, stage: str | None, queue_position: int | None = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE selfie_results SET progress_stage = ?, queue_position = ? WHERE id = ? AND status = 'processing'",
+                (stage, queue_position, result_id),
+            )
+            conn.commit()
+
+    def record_stage_timings(self, result_id: str, timings: dict[str, float]) -> None:
+        """Seconds per stage of the latest attempt, as a JSON object."""
+        encoded = json.dumps({stage: round(seconds, 4) for stage, seconds in timings.items()})
+        with self._connect() as conn:
+            conn.execute("UPDATE selfie_results SET stage_timings = ? WHERE id = ?", (encoded, result_id))
+            conn.commit()
+
     def mark_ready(
         self,
         result_id: str,
@@ -130,9 +412,12 @@ class ResultsRepository:
         generated_object_key: str,
         final_object_key: str,
         public_image_url: str,
-    ) -> None:
+        thumbnail_object_key: str | None = None,
+        social_card_object_key: str | None = None,
+    ) -> bool:
+        """False when the result stopped processing meanwhile (e.g. timed out); it is left as is."""
         with self._connect() as conn:
-            conn.execute(
+            updated = conn.execute(
                 """
                 UPDATE selfie_results
                 SET status='ready',
@@ -140,13 +425,24 @@ class ResultsRepository:
                     generated_object_key=?,
                     final_object_key=?,
                     public_image_url=?,
+                    thumbnail_object_key=?,
+                    social_card_object_key=?,
                     error_message=NULL,
                     internal_error_code=NULL
-                WHERE id=?
+                WHERE id=? AND status='processing'
                 """,
-                (upload_object_key, generated_object_key, final_object_key, public_image_url, result_id),
-            )
+                (
+                    upload_object_key,
+                    generated_object_key,
+                    final_object_key,
+                    public_image_url,
+                    thumbnail_object_key,
+                    social_card_object_key,
+                    result_id,
+                ),
+            ).rowcount
             conn.commit()
+            return updated > 0
 
     def mark_failed(
         self,
@@ -154,36 +450,56 @@ class ResultsRepository:
         error_message: str,
         moderation_status: str = "passed",
         internal_error_code: str | None = None,
-    ) -> None:
+    ) -> bool:
+        """False when the result already finished (e.g. timed out); its error is kept."""
         with self._connect() as conn:
-            conn.execute(
+            updated = conn.execute(
                 """
                 UPDATE selfie_results
                 SET status='failed', error_message=?, moderation_status=?, internal_error_code=?
-                WHERE id=?
+                WHERE id=? AND status='processing'
                 """,
                 (error_message, moderation_status, internal_error_code, result_id),
-            )
+            ).rowcount
             conn.commit()
+            return updated > 0
 
     def get_result(self, result_id: str) -> SelfieResult | None:
         with self._connect() as conn:
-            row = conn.execute("SELECT * FROM selfie_results WHERE id = ?", (result_id,)).fetchone()
+            row = conn.execute(f"SELECT {_RESULT_COLUMNS} FROM selfie_results WHERE id = ?", (result_id,)).fetchone()
             if not row:
                 return None
-            return SelfieResult(**dict(row))
+            return SelfieResult(*row)
 
-    def get_expired_results(self, now_iso: str) -> list[SelfieResult]:
+    def get_expired_results_page(
+        self,
+        now_iso: str,
+        limit: int,
+        after: tuple[str, str] | None = None,
+    ) -> list[SelfieResult]:
+        """Keyset page of expired rows ordered by (expires_at, id), starting after `after`."""
+        after_expires_at, after_id = after or ("", "")
         with self._connect() as conn:
-            rows = conn.execute("SELECT * FROM selfie_results WHERE expires_at <= ?", (now_iso,)).fetchall()
-            return [SelfieResult(**dict(row)) for row in rows]
+            rows = conn.execute(
+                f"""
+                SELECT {_RESULT_COLUMNS} FROM selfie_results
+                WHERE expires_at <= ? AND (expires_at, id) > (?, ?)
+                ORDER BY expires_at, id
+                LIMIT ?
+                """,
+                (now_iso, after_expires_at, after_id, limit),
+            ).fetchall()
+            return [SelfieResult(*row) for row in rows]
 
     def delete_results(self, result_ids: list[str]) -> None:
         if not result_ids:
             return
-        placeholders = ",".join("?" for _ in result_ids)
         with self._connect() as conn:
-            conn.execute(f"DELETE FROM selfie_results WHERE id IN ({placeholders})", result_ids)
+            # Chunked to stay under SQLite's bound-variable limit.
+            for i in range(0, len(result_ids), DELETE_CHUNK_SIZE):
+                chunk = result_ids[i : i + DELETE_CHUNK_SIZE]
+                placeholders = ",".join("?" for _ in chunk)
+                conn.execute(f"DELETE FROM selfie_results WHERE id IN ({placeholders})", chunk)
             conn.commit()
 
 
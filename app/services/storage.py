@@ -1,8 +1,33 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
 import boto3
 from botocore.client import Config
 
+# S3 DeleteObjects limit per request.
+MAX_DELETE_BATCH = 1000
+PRESIGN_CACHE_SIZE = 10_000
+# A cached URL is handed out until less than this fraction of its lifetime is left.
+PRESIGN_MIN_REMAINING_FRACTION = 0.5
+
 
 class S3Storage:
+    """
+    Async facade over boto3. Calls run on a dedicated executor sized to the
+    connection pool, so concurrent jobs never queue behind unrelated thread work
+    and every worker thread can hold its own kept-alive connection.
+
+    Presigned URLs are cached per (key, expiry, download name) and reused until
+    `presign_min_remaining` of their lifetime is left, so repeat views skip the
+    SigV4 signing and get the same URL, which browsers and CDNs can cache.
+    """
+
     def __init__(
         self,
         endpoint_url: str,
@@ -11,6 +36,11 @@ class S3Storage:
         access_key: str,
         secret_key: str,
         public_base_url: str,
+        max_pool_connections: int = 20,
+        tcp_keepalive: bool = True,
+        presign_cache_size: int = PRESIGN_CACHE_SIZE,
+        presign_min_remaining: float = PRESIGN_MIN_REMAINING_FRACTION,
+        clock: Callable[[], float] = time.time,
     ) -> None:
         self.bucket = bucket
         self.public_base_url = public_base_url.rstrip("/")
@@ -20,22 +50,64 @@ class S3Storage:
             aws_access_key_id=access_key,
             aws_secret_access_key=secret_key,
             region_name=region,
-            config=Config(signature_version="s3v4"),
+            config=Config(
+                signature_version="s3v4",
+                max_pool_connections=max_pool_connections,
+                tcp_keepalive=tcp_keepalive,
+            ),
         )
+        self._executor = ThreadPoolExecutor(max_workers=max_pool_connections, thread_name_prefix="s3")
+        self.presign_cache_size = presign_cache_size
+        self.presign_min_remaining = presign_min_remaining
+        self.presign_hits = 0
+        self.presign_misses = 0
+        self._clock = clock
+        self._presigned: OrderedDict[tuple[str, int, str | None], tuple[str, float]] = OrderedDict()
+        self._presign_lock = threading.Lock()
+
+    async def _call(self, fn: Callable[..., Any], **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, **kwargs))
 
-    def upload_bytes(self, key: str, data: bytes, content_type: str) -> str:
-        self.client.put_object(
+    async def upload_bytes(self, key: str, data: bytes, content_type: str, cache_control: str | None = None) -> str:
+        extra = {"CacheControl": cache_control} if cache_control else {}
+        await self._call(
+            self.client.put_object,
             Bucket=self.bucket,
             Key=key,
             Body=data,
             ContentType=content_type,
+            **extra,
         )
+        return self.public_url(key)
+
+    def public_url(self, key: str) -> str:
         return f"{self.public_base_url}/{key}"
 
-    def delete_object(self, key: str) -> None:
+    async def get_bytes(self, key: str) -> bytes:
+        def _get(**kwargs: Any) -> bytes:
+            # The body is streamed, so read it on the executor thread too.
+            return self.client.get_object(**kwargs)["Body"].read()
+
+        return await self._call(_get, Bucket=self.bucket, Key=key)
+
+    async def delete_object(self, key: str) -> None:
         if not key:
             return
-        self.client.delete_object(Bucket=self.bucket, Key=key)
+        await self._call(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def delete_objects(self, keys: list[str]) -> set[str]:
+        """Delete up to MAX_DELETE_BATCH keys in one request; returns the keys S3 confirmed."""
+        if not keys:
+            return set()
+        if len(keys) > MAX_DELETE_BATCH:
+            raise ValueError(f"DeleteObjects accepts at most {MAX_DELETE_BATCH} keys")
+        response = await self._call(
+            self.client.delete_objects,
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": False},
+        )
+        return {item["Key"] for item in response.get("Deleted", [])}
 
     def presigned_get_url(
         self,
@@ -43,6 +115,27 @@ class S3Storage:
         expires_in: int,
         download_filename: str | None = None,
     ) -> str:
+        cache_key = (key, expires_in, download_filename)
+        now = self._clock()
+        with self._presign_lock:
+            cached = self._presigned.get(cache_key)
+            if cached is not None and cached[1] - now >= expires_in * self.presign_min_remaining:
+                self._presigned.move_to_end(cache_key)
+                self.presign_hits += 1
+                return cached[0]
+            self.presign_misses += 1
+
+        url = self._sign(key, expires_in, download_filename)
+        if self.presign_cache_size > 0:
+            with self._presign_lock:
+                self._presigned[cache_key] = (url, now + expires_in)
+                self._presigned.move_to_end(cache_key)
+                while len(self._presigned) > self.presign_cache_size:
+                    self._presigned.popitem(last=False)
+        return url
+
+    def _sign(self, key: str, expires_in: int, download_filename: str | None) -> str:
+        # Signing is local HMAC work, no network round-trip.
         params = {
             "Bucket": self.bucket,
             "Key": key,
@@ -54,3 +147,83 @@ class S3Storage:
             Params=params,
             ExpiresIn=expires_in,
         )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class LocalStorage:
+    """
+    Filesystem stand-in for S3 with the same interface, for local runs and load
+    tests without AWS. Objects are served by the app under `public_base_url`.
+    """
+
+    def __init__(self, root_dir: str, public_base_url: str = "/local-storage") -> None:
+        self.root = Path(root_dir).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Object key escapes storage root: {key}")
+        return path
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    async def upload_bytes(self, key: str, data: bytes, content_type: str, cache_control: str | None = None) -> str:
+        # Served by StaticFiles, which sets its own caching headers.
+        await asyncio.to_thread(self._write, key, data)
+        return self.public_url(key)
+
+    def public_url(self, key: str) -> str:
+        return f"{self.public_base_url}/{key}"
+
+    async def get_bytes(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._path(key).read_bytes)
+
+    async def delete_object(self, key: str) -> None:
+        if not key:
+            return
+        await asyncio.to_thread(self._path(key).unlink, missing_ok=True)
+
+    async def delete_objects(self, keys: list[str]) -> set[str]:
+        def _delete_all() -> set[str]:
+            for key in keys:
+                self._path(key).unlink(missing_ok=True)
+            return set(keys)
+
+        return await asyncio.to_thread(_delete_all)
+
+    def presigned_get_url(
+        self,
+        key: str,
+        expires_in: int,
+        download_filename: str | None = None,
+    ) -> str:
+        return f"{self.public_base_url}/{key}"
+
+    def close(self) -> None:
+        return None
+
+
+def create_storage(settings) -> S3Storage | LocalStorage | None:
+    if settings.storage_backend == "local":
+        return LocalStorage(settings.local_storage_dir)
+    if settings.s3_bucket and settings.s3_endpoint_url and settings.s3_public_base_url:
+        return S3Storage(
+            endpoint_url=settings.s3_endpoint_url,
+            bucket=settings.s3_bucket,
+            region=settings.s3_region,
+            access_key=settings.s3_access_key_id,
+            secret_key=settings.s3_secret_access_key,
+            public_base_url=settings.s3_public_base_url,
+            max_pool_connections=settings.s3_max_pool_connections,
+            tcp_keepalive=settings.s3_tcp_keepalive,
+            presign_cache_size=settings.s3_presign_cache_size,
+            presign_min_remaining=settings.s3_presign_min_remaining,
+        )
+    return None
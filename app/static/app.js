@@ -190,6 +190,13 @@ function renderResult(payload) {
     resultPanel.classList.remove("hidden");
   }
   if (resultImage) {
+    if (payload.thumbnail_url) {
+      // Phones pick the 512px WebP instead of the full 1024px image.
+      resultImage.sizes = "(max-width: 680px) 85vw, 900px";
+      resultImage.srcset = `${payload.thumbnail_url} 512w, ${payload.image_url} 1024w`;
+    } else {
+      resultImage.removeAttribute("srcset");
+    }
     resultImage.src = payload.image_url;
   }
   if (downloadBtn) {
@@ -200,13 +207,34 @@ function renderResult(payload) {
   }
 }
 
+function describeProgress(payload) {
+  const progress = payload && payload.progress;
+  if (!progress) {
+    return "";
+  }
+  if (progress.stage === "queued" && progress.queue_position != null) {
+    return `Queued #${progress.queue_position + 1}. Your FLAMES selfie will start shortly.`;
+  }
+  if (progress.stage === "generating") {
+    return "Generating your FLAMES selfie.";
+  }
+  if (progress.stage === "finishing") {
+    return "Adding the finishing touches.";
+  }
+  return "";
+}
+
+function _isFinalStatus(status) {
+  return status === "ready" || status === "failed" || status === "expired";
+}
+
 async function pollUntilDone(resultId, onUpdate) {
   while (true) {
     const payload = await fetchResult(resultId);
     if (onUpdate) {
       onUpdate(payload);
     }
-    if (payload.status === "ready" || payload.status === "failed" || payload.status === "expired") {
+    if (_isFinalStatus(payload.status)) {
       return payload;
     }
     const waitSeconds = Number(payload.retry_after_seconds || 2);
@@ -214,6 +242,42 @@ async function pollUntilDone(resultId, onUpdate) {
   }
 }
 
+function _streamUntilDone(resultId, onUpdate) {
+  // Resolves with the final payload, or null if the stream dropped before one arrived.
+  return new Promise((resolve) => {
+    const source = new EventSource(`/api/selfie/result/${resultId}/events`);
+    source.addEventListener("status", (event) => {
+      let payload;
+      try {
+        payload = JSON.parse(event.data);
+      } catch (err) {
+        return;
+      }
+      if (onUpdate) {
+        onUpdate(payload);
+      }
+      if (_isFinalStatus(payload.status)) {
+        source.close();
+        resolve(payload);
+      }
+    });
+    source.onerror = () => {
+      source.close();
+      resolve(null);
+    };
+  });
+}
+
+async function waitUntilDone(resultId, onUpdate) {
+  if (typeof EventSource !== "undefined") {
+    const payload = await _streamUntilDone(resultId, onUpdate);
+    if (payload) {
+      return payload;
+    }
+  }
+  return pollUntilDone(resultId, onUpdate);
+}
+
 function initGeneratePage() {
   const body = document.body;
   const createContent = byId("create-content");
@@ -278,6 +342,13 @@ function initGeneratePage() {
     }
   }
 
+  function showProgress(payload) {
+    const message = describeProgress(payload);
+    if (message) {
+      setStatus(message);
+    }
+  }
+
   function setGeneratingState(isGenerating) {
     if (createContent) {
       createContent.classList.toggle("hidden", isGenerating);
@@ -466,7 +537,7 @@ function initGeneratePage() {
     try {
       const payload = await postGenerate(uploadBlob);
       localStorage.setItem(pendingKey, payload.result_id);
-      const finalPayload = await pollUntilDone(payload.result_id);
+      const finalPayload = await waitUntilDone(payload.result_id, showProgress);
       localStorage.removeItem(pendingKey);
 
       if (finalPayload.status === "ready") {
@@ -516,7 +587,7 @@ function initGeneratePage() {
   if (pendingResultId) {
     setGeneratingState(true);
     setStatus("Resuming your FLAMES selfie. Please wait.");
-    pollUntilDone(pendingResultId)
+    waitUntilDone(pendingResultId, showProgress)
       .then((finalPayload) => {
         if (finalPayload.status === "ready") {
           renderResult(finalPayload);
@@ -538,14 +609,18 @@ function initGeneratePage() {
   }
 }
 
-async function initSharePage(resultId) {
+async function initSharePage(resultId, renderedStatus) {
+  if (_isFinalStatus(renderedStatus)) {
+    // The server already rendered the image or the error into the page.
+    return;
+  }
   const errorText = byId("error-text");
   const progressPanel = byId("share-progress");
   try {
     if (progressPanel) {
       progressPanel.classList.remove("hidden");
     }
-    const finalPayload = await pollUntilDone(resultId);
+    const finalPayload = await waitUntilDone(resultId);
     if (finalPayload.status === "ready") {
       if (progressPanel) {
         progressPanel.classList.add("hidden");
@@ -568,7 +643,7 @@ function initApp() {
   const page = body.dataset.page;
 
   if (page === "share") {
-    initSharePage(body.dataset.resultId);
+    initSharePage(body.dataset.resultId, body.dataset.status);
     return;
   }
 
@@ -0,0 +1,156 @@
+"""
+Standalone generation worker. Claims jobs from the durable queue in the results
+database and runs them (fal round-trip, compositing, storage PUTs), so web
+processes started with GEN_WORKER_MODE=external only enqueue and serve status.
+
+    python -m app.worker [--concurrency 5] [--cpu-workers 2] [--metrics-port 9100]
+
+For local testing without fal or AWS: FAL_BACKEND=fake STORAGE_BACKEND=local.
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+from functools import partial
+from pathlib import Path
+
+from starlette.datastructures import State
+
+from app.clients.fal_client import create_fal_client
+from app.config import Settings
+from app.services.admission import InProcessSlots, SqliteSlots
+from app.services.cpu_pool import create_cpu_pool
+from app.services.image_pipeline import create_download_client, warm_frame_cache
+from app.services.job_queue import JobDispatcher, requeue_orphaned_jobs
+from app.services.metrics import render_prometheus, state_metrics
+from app.services.notify import ResultNotifier
+from app.services.ownership import worker_identity
+from app.services.results_repo import ResultsRepository
+from app.services.storage import create_storage
+
+logger = logging.getLogger(__name__)
+
+DRAIN_SECONDS = 30.0
+METRICS_HOST = "127.0.0.1"
+
+
+class WorkerApp:
+    """The slice of the FastAPI app that job code reads from `app.state`."""
+
+    def __init__(self) -> None:
+        self.state = State()
+
+
+async def _serve_metrics(state: State, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Minimal HTTP responder for Prometheus scrapes; every path gets the metrics."""
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        # Reads the shared SQLite state, which can wait on its write lock.
+        gauges, counters = await asyncio.to_thread(state_metrics, state)
+        body = render_prometheus(gauges, counters).encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_worker(
+    settings: Settings,
+    concurrency: int,
+    cpu_workers: int,
+    stop: asyncio.Event,
+    drain_seconds: float = DRAIN_SECONDS,
+    metrics_port: int = 0,
+    metrics_host: str = METRICS_HOST,
+) -> None:
+    storage = create_storage(settings)
+    if storage is None:
+        raise RuntimeError("Storage is not configured")
+
+    app = WorkerApp()
+    app.state.settings = settings
+    app.state.storage = storage
+    app.state.repo = ResultsRepository(settings.db_path, pooled=settings.db_pooled)
+    app.state.repo.init_db()
+    app.state.notifier = ResultNotifier(asyncio.get_running_loop())
+    owner = worker_identity()
+    if settings.rate_limit_backend == "sqlite":
+        # Several worker processes then share one concurrency budget.
+        app.state.gen_run_slots = SqliteSlots(settings.rate_limit_db_path, "run", concurrency, owner)
+    else:
+        app.state.gen_run_slots = InProcessSlots(concurrency)
+    app.state.cpu_pool = create_cpu_pool(cpu_workers, settings.frame_asset_path)
+    app.state.fal_client = create_fal_client(settings)
+    app.state.http_client = create_download_client()
+    if Path(settings.frame_asset_path).exists():
+        await asyncio.to_thread(warm_frame_cache, settings.frame_asset_path)
+
+    requeue_orphaned_jobs(app.state.repo, owner, settings.gen_job_max_attempts)
+    dispatcher = JobDispatcher(app, owner)
+    dispatcher_task = asyncio.create_task(dispatcher.run())
+    metrics_server = None
+    if metrics_port:
+        # Jobs run here rather than in the web tier, so their stage metrics are scraped here too.
+        metrics_server = await asyncio.start_server(partial(_serve_metrics, app.state), metrics_host, metrics_port)
+    logger.info("worker_started owner=%s concurrency=%d cpu_workers=%d", owner, concurrency, cpu_workers)
+    try:
+        await stop.wait()
+        logger.info("worker_draining seconds=%.0f", drain_seconds)
+        await dispatcher.drain(drain_seconds)
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        # Jobs still running after the drain keep their leases and are resumed on the next start.
+        dispatcher_task.cancel()
+        try:
+            await dispatcher_task
+        except asyncio.CancelledError:
+            pass
+        await app.state.fal_client.aclose()
+        await app.state.http_client.aclose()
+        storage.close()
+        if app.state.cpu_pool:
+            app.state.cpu_pool.shutdown(wait=False, cancel_futures=True)
+        app.state.gen_run_slots.close()
+        app.state.repo.close()
+        logger.info("worker_stopped owner=%s", owner)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    settings = Settings.load()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await run_worker(
+        settings,
+        concurrency=args.concurrency or settings.gen_max_concurrency,
+        cpu_workers=settings.gen_cpu_workers if args.cpu_workers is None else args.cpu_workers,
+        stop=stop,
+        drain_seconds=args.drain_seconds,
+        metrics_port=args.metrics_port,
+        metrics_host=args.metrics_host,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run generation jobs from the queue.")
+    parser.add_argument("--concurrency", type=int, default=0, help="Jobs run at once (default: GEN_MAX_CONCURRENCY)")
+    parser.add_argument("--cpu-workers", type=int, default=None, help="Image worker processes (default: GEN_CPU_WORKERS)")
+    parser.add_argument("--drain-seconds", type=float, default=DRAIN_SECONDS, help="Grace period for running jobs on shutdown")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port (default: off)")
+    parser.add_argument("--metrics-host", default=METRICS_HOST, help="Address for --metrics-port")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Encode time and output size of the final campaign image per output format.
+
+    python -m benchmarks.bench_encoders [--images test/images] [--repeat 3]
+
+Each source image is normalized and framed once; only the encode is timed.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from app.services.image_pipeline import OUTPUT_FORMATS, apply_frame_overlay, encode_image, normalize_to_output_size
+
+FRAME_PATH = "app/static/campaign/frame_v1.png"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default="test/images")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(Path(args.images).glob("*.jpg"))
+    if not paths:
+        raise SystemExit(f"No .jpg images found in {args.images}")
+
+    framed_images = []
+    for path in paths:
+        with Image.open(path) as source:
+            framed_images.append((path.name, apply_frame_overlay(normalize_to_output_size(source.convert("RGB")), FRAME_PATH)))
+
+    print(f"{'image':<10}{'format':<8}{'encode ms':>12}{'size KiB':>12}")
+    totals = {name: [0.0, 0] for name in OUTPUT_FORMATS}
+    for image_name, framed in framed_images:
+        for name in OUTPUT_FORMATS:
+            best = float("inf")
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                data = encode_image(framed, name)
+                best = min(best, time.perf_counter() - started)
+            totals[name][0] += best
+            totals[name][1] += len(data)
+            print(f"{image_name:<10}{name:<8}{best * 1000:>12.1f}{len(data) / 1024:>12.1f}")
+
+    count = len(framed_images)
+    print()
+    for name, (seconds, size) in totals.items():
+        print(f"{'mean':<10}{name:<8}{seconds / count * 1000:>12.1f}{size / count / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Cold-start cost of loading a frame overlay that needs resizing.
+
+    python -m benchmarks.bench_frame_resize [--source 2048] [--repeat 3]
+
+Compares the original per-pixel un-premultiply loop with the current
+`_resize_rgba_premultiplied`, and times a cold `_load_frame` call.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageChops
+
+from app.services import image_pipeline
+from app.services.image_pipeline import OUTPUT_SIZE, _load_frame, _resize_rgba_premultiplied
+
+FRAME_PATH = "app/static/campaign/frame_v1.png"
+
+
+def _legacy_resize_rgba_premultiplied(image: Image.Image, size: tuple[int, int], resample) -> Image.Image:
+    r, g, b, a = image.convert("RGBA").split()
+    channels = [ImageChops.multiply(c, a).resize(size, resample=resample) for c in (r, g, b)]
+    a = a.resize(size, resample=resample)
+    ab = a.tobytes()
+    out = []
+    for channel in channels:
+        cb = channel.tobytes()
+        buf = bytearray(len(ab))
+        for i, alpha in enumerate(ab):
+            if alpha:
+                buf[i] = min(255, (cb[i] * 255) // alpha)
+        out.append(Image.frombytes("L", size, bytes(buf)))
+    return Image.merge("RGBA", (*out, a))
+
+
+def _best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=int, default=2048, help="Side length of the synthetic source frame")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frame = Image.open(FRAME_PATH).convert("RGBA").resize((args.source, args.source), Image.Resampling.NEAREST)
+    target = (OUTPUT_SIZE, OUTPUT_SIZE)
+    resample = Image.Resampling.LANCZOS
+
+    legacy = _best_of(args.repeat, lambda: _legacy_resize_rgba_premultiplied(frame, target, resample))
+    current = _best_of(args.repeat, lambda: _resize_rgba_premultiplied(frame, target, resample))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "frame.png"
+        frame.save(path)
+
+        def cold_load() -> None:
+            image_pipeline._FRAME_REGISTRY.clear()
+            _load_frame(str(path))
+
+        cold = _best_of(args.repeat, cold_load)
+
+    print(f"source {args.source}x{args.source} -> {target[0]}x{target[1]} (best of {args.repeat})")
+    print(f"  legacy resize:   {legacy * 1000:8.1f} ms")
+    print(f"  current resize:  {current * 1000:8.1f} ms  ({legacy / current:.1f}x faster)")
+    print(f"  cold _load_frame:{cold * 1000:8.1f} ms  (includes PNG decode)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Rate limiter check() throughput and memory per tracked key.
+
+    python -m benchmarks.bench_ratelimit [--keys 100000]
+
+Compares the original per-IP timestamp deques with the in-process sliding-window
+counters, then times the SQLite backend shared across workers (check() and a
+queue-slot acquire/release round trip).
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+
+from app.services.admission import SqliteSlots
+from app.services.ownership import worker_identity
+from app.services.ratelimit import InProcessRateLimiter, RateLimitExceeded, SqliteRateLimiter
+
+
+class LegacyDequeRateLimiter:
+    def __init__(self, per_minute: int, per_day: int) -> None:
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self._minute: dict[str, deque[float]] = {}
+        self._day: dict[str, deque[float]] = {}
+
+    def check(self, key: str) -> None:
+        now = time.time()
+        minute_q = self._minute.setdefault(key, deque())
+        day_q = self._day.setdefault(key, deque())
+        while minute_q and minute_q[0] <= now - 60.0:
+            minute_q.popleft()
+        while day_q and day_q[0] <= now - 86400.0:
+            day_q.popleft()
+        if len(minute_q) >= self.per_minute:
+            raise RateLimitExceeded(retry_after_seconds=1)
+        if len(day_q) >= self.per_day:
+            raise RateLimitExceeded(retry_after_seconds=60)
+        minute_q.append(now)
+        day_q.append(now)
+
+
+def _throughput(limiter, keys: list[str], rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for key in keys:
+            try:
+                limiter.check(key)
+            except RateLimitExceeded:
+                pass
+    return rounds * len(keys) / (time.perf_counter() - started)
+
+
+def _bytes_per_key(factory, keys: list[str]) -> float:
+    # Measured separately: tracemalloc slows allocation and would skew the throughput.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    limiter = factory()
+    for key in keys:
+        limiter.check(key)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(keys)
+
+
+def _slot_round_trip_us(db_path: str, iterations: int) -> float:
+    async def run() -> float:
+        slots = SqliteSlots(db_path, "queue", limit=iterations, owner=worker_identity())
+        try:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                await slots.release(await slots.try_acquire())
+            return (time.perf_counter() - started) / iterations * 1e6
+        finally:
+            slots.close()
+
+    return asyncio.run(run())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    keys = [f"203.0.{i // 256 % 256}.{i % 256}-{i}" for i in range(args.keys)]
+    factories = (
+        ("deques", lambda: LegacyDequeRateLimiter(per_minute=3, per_day=20)),
+        ("counters", lambda: InProcessRateLimiter(per_minute=3, per_day=20)),
+    )
+    print(f"{args.keys} keys, {args.rounds} rounds")
+    for label, factory in factories:
+        rate = _throughput(factory(), keys, args.rounds)
+        per_key = _bytes_per_key(factory, keys)
+        print(f"{label:<10}{rate:>14,.0f} check()/s{per_key:>10.0f} B/key (excl. key strings)")
+
+    sqlite_keys = keys[: min(len(keys), 20_000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "limits.db")
+        limiter = SqliteRateLimiter(db_path, per_minute=3, per_day=20)
+        try:
+            rate = _throughput(limiter, sqlite_keys, args.rounds)
+        finally:
+            limiter.close()
+        print(f"{'sqlite':<10}{rate:>14,.0f} check()/s{1e6 / rate:>10.1f} us/check ({len(sqlite_keys)} keys)")
+        slot_us = _slot_round_trip_us(db_path, 5_000)
+        print(f"{'slots':<10}{slot_us:>14.1f} us per try_acquire() + release()")
+
+
+
+if __name__ == "__main__":
+    main()
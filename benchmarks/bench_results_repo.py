@@ -0,0 +1,66 @@
+"""
+ResultsRepository.get_result throughput, connection-per-call vs pooled WAL mode.
+
+    python -m benchmarks.bench_results_repo [--rows 1000] [--seconds 2]
+"""
+
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from app.services.results_repo import ResultsRepository
+
+
+def _seed(repo: ResultsRepository, rows: int) -> list[str]:
+    now = datetime.now(timezone.utc)
+    ids = []
+    for i in range(rows):
+        result_id = f"bench-{i}"
+        repo.create_processing_result(
+            result_id=result_id,
+            created_at=now.isoformat(),
+            expires_at=(now + timedelta(days=30)).isoformat(),
+            prompt_version="v1",
+            user_agent_hash=None,
+            client_request_id=result_id,
+            ip_hash="bench",
+        )
+        ids.append(result_id)
+    return ids
+
+
+def _ops_per_sec(repo: ResultsRepository, ids: list[str], seconds: float) -> float:
+    ops = 0
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for result_id in ids[:100]:
+            repo.get_result(result_id)
+        ops += 100
+    return ops / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, pooled in (("per-call", False), ("pooled", True)):
+            repo = ResultsRepository(str(Path(tmp) / f"{label}.db"), pooled=pooled)
+            repo.init_db()
+            ids = _seed(repo, args.rows)
+            results[label] = _ops_per_sec(repo, ids, args.seconds)
+            repo.close()
+
+    for label, ops in results.items():
+        print(f"{label:<10}{ops:>12,.0f} get_result/s")
+    print(f"speedup   {results['pooled'] / results['per-call']:>12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import socket
+
+from app.services.admission import InProcessSlots, SqliteSlots
+from app.services.ownership import worker_identity
+
+
+def _parent_identity() -> str:
+    # The parent (the shell or runner that started pytest) outlives the test.
+    return f"{socket.gethostname()}:{os.getppid()}:parent"
+
+
+def test_in_process_slots_fail_fast_and_wait():
+    async def scenario() -> None:
+        slots = InProcessSlots(limit=2)
+        first = await slots.try_acquire()
+        second = await slots.try_acquire()
+        assert first and second
+        assert await slots.try_acquire() is None
+        assert len(slots) == 2
+
+        waiter = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await slots.release(first)
+        assert await asyncio.wait_for(waiter, 1)
+        assert len(slots) == 2
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_slots_are_shared_between_instances(tmp_path):
+    async def scenario() -> None:
+        db_path = str(tmp_path / "limits.db")
+        owner = worker_identity()
+        first = SqliteSlots(db_path, "queue", limit=2, owner=owner)
+        # Stands in for another live worker process on the host.
+        second = SqliteSlots(db_path, "queue", limit=2, owner=_parent_identity())
+        other = SqliteSlots(db_path, "run", limit=1, owner=owner)
+        try:
+            token = await first.try_acquire()
+            assert await second.try_acquire()
+            assert await first.try_acquire() is None
+            # Separate names count separately.
+            assert await other.try_acquire()
+
+            await first.release(token)
+            assert await second.try_acquire()
+            assert len(first) == 2
+        finally:
+            for slots in (first, second, other):
+                slots.close()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_slots_reclaim_only_dead_holders(tmp_path):
+    async def scenario() -> None:
+        db_path = str(tmp_path / "limits.db")
+        # Same pid, different nonce: an earlier incarnation of this process that crashed.
+        crashed = SqliteSlots(db_path, "run", limit=1, owner=f"{socket.gethostname()}:{os.getpid()}:crashed")
+        live = SqliteSlots(db_path, "run", limit=1, owner=_parent_identity())
+        slots = SqliteSlots(db_path, "run", limit=1, owner=worker_identity())
+        try:
+            assert await crashed.try_acquire()
+            reclaimed = await asyncio.wait_for(slots.acquire(), 1)
+            await slots.release(reclaimed)
+
+            token = await live.try_acquire()
+            assert token
+            # However long the live holder runs, its slot is not handed out again.
+            assert await slots.try_acquire() is None
+            await live.release(token)
+            assert await slots.try_acquire()
+        finally:
+            for held in (crashed, live, slots):
+                held.close()
+
+    asyncio.run(scenario())
@@ -1,3 +1,6 @@
+import json
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 
 from fastapi.testclient import TestClient
@@ -22,6 +25,8 @@ def _seed_ready_result(app, result_id: str, expires_at: str):
         generated_object_key=f"selfies/{result_id}/generated.png",
         final_object_key=f"selfies/{result_id}/final.png",
         public_image_url=f"https://cdn.example.com/selfies/{result_id}/final.png",
+        thumbnail_object_key=f"selfies/{result_id}/thumb.webp",
+        social_card_object_key=f"selfies/{result_id}/card.jpg",
     )
 
 
@@ -40,6 +45,23 @@ def test_get_result_ready(monkeypatch, tmp_path):
         assert payload["status"] == "ready"
         assert payload["share_url"].endswith("/r/ready-1")
         assert payload["image_url"].endswith("/api/selfie/result/ready-1/image")
+        assert payload["thumbnail_url"].endswith("/api/selfie/result/ready-1/image?variant=thumbnail")
+        assert payload["social_card_url"].endswith("/api/selfie/result/ready-1/image?variant=card")
+
+
+def test_get_result_public_delivery_points_at_cdn(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    monkeypatch.setenv("IMAGE_DELIVERY", "public")
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        expires = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+        _seed_ready_result(app, "ready-cdn", expires)
+
+        payload = client.get("/api/selfie/result/ready-cdn").json()
+        assert payload["image_url"] == "https://cdn.example.com/selfies/ready-cdn/final.png"
+        assert payload["download_url"].endswith("/api/selfie/result/ready-cdn/download")
+        assert client.get("/r/ready-cdn").status_code == 200
 
 
 def test_get_result_expired(monkeypatch, tmp_path):
@@ -55,6 +77,53 @@ def test_get_result_expired(monkeypatch, tmp_path):
         assert response.json()["status"] == "expired"
 
 
+def _queue_local_job(app, result_id: str, created: datetime, available_at: float) -> None:
+    assert app.state.repo.create_queued_result(
+        result_id=result_id,
+        created_at=created.isoformat(),
+        expires_at=(created + timedelta(days=30)).isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=None,
+        ip_hash=None,
+        upload_object_key=f"selfies/{result_id}/upload.jpg",
+        content_type="image/jpeg",
+        origin=app.state.job_owner,
+        max_queue=10,
+        now=available_at,
+    )
+    # As the generate route does: this process holds the upload bytes.
+    app.state.dispatcher.submit(result_id, b"photo")
+
+
+def test_timed_out_result_drops_its_job(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        repo = app.state.repo
+        dispatcher = app.state.dispatcher
+        old = datetime.now(timezone.utc) - timedelta(seconds=app.state.settings.processing_timeout_seconds + 60)
+        # Not due yet (e.g. a retry backing off), so the dispatcher leaves it queued.
+        _queue_local_job(app, "stale-1", old, available_at=time.time() + 3600)
+
+        payload = client.get("/api/selfie/result/stale-1").json()
+        assert (payload["status"], payload["error_message"]) == ("failed", "Timed out. Please try again.")
+        assert repo.count_jobs() == 0
+        assert repo.claim_job(app.state.job_owner, now=time.time() + 7200, lease_seconds=60) is None
+        assert "stale-1" not in dispatcher._pending
+
+        # Failed by another process, which leaves the job for a claim to drop.
+        _queue_local_job(app, "stale-2", old, available_at=time.time() + 3600)
+        repo.mark_failed("stale-2", "Timed out. Please try again.", internal_error_code="TIMED_OUT")
+        repo.retry_job("stale-2", available_at=time.time())
+        deadline = time.time() + 5
+        while "stale-2" in dispatcher._pending and time.time() < deadline:
+            time.sleep(0.05)
+        assert repo.get_job("stale-2") is None
+        assert "stale-2" not in dispatcher._pending
+
+
 def test_share_page_renders(monkeypatch, tmp_path):
     monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
     app = create_app(validate_env=False)
@@ -63,3 +132,122 @@ def test_share_page_renders(monkeypatch, tmp_path):
         response = client.get("/r/demo-123")
         assert response.status_code == 200
         assert 'data-result-id="demo-123"' in response.text
+
+
+def test_get_result_ready_is_cacheable_and_revalidates(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        expires = (datetime.now(timezone.utc) + timedelta(minutes=10)).isoformat()
+        _seed_ready_result(app, "ready-etag", expires)
+
+        response = client.get("/api/selfie/result/ready-etag")
+        etag = response.headers["etag"]
+        max_age = int(response.headers["cache-control"].split("max-age=")[1])
+        assert response.headers["cache-control"].startswith("public")
+        assert 590 <= max_age <= 600
+
+        revalidated = client.get("/api/selfie/result/ready-etag", headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["etag"] == etag
+        assert client.get("/api/selfie/result/ready-etag", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_share_page_prerenders_ready_result(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        expires = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+        _seed_ready_result(app, "ready-share", expires)
+
+        response = client.get("/r/ready-share")
+        assert response.status_code == 200
+        assert 'data-status="ready"' in response.text
+        assert '<meta property="og:image" content="http://testserver/api/selfie/result/ready-share/image?variant=card">' in response.text
+        assert 'src="http://testserver/api/selfie/result/ready-share/image"' in response.text
+        assert 'srcset="http://testserver/api/selfie/result/ready-share/image?variant=thumbnail 512w' in response.text
+        assert response.headers["cache-control"] == "public, max-age=3600"
+
+        revalidated = client.get("/r/ready-share", headers={"If-None-Match": response.headers["etag"]})
+        assert revalidated.status_code == 304
+
+        pending = client.get("/r/demo-123")
+        assert pending.headers["cache-control"] == "no-cache"
+        assert "og:image" not in pending.text
+
+
+def _sse_payloads(text: str) -> list[dict]:
+    return [json.loads(line[len("data: "):]) for line in text.splitlines() if line.startswith("data: ")]
+
+
+def test_result_events_ready_closes_immediately(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        expires = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+        _seed_ready_result(app, "ready-sse", expires)
+
+        response = client.get("/api/selfie/result/ready-sse/events")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert [p["status"] for p in _sse_payloads(response.text)] == ["ready"]
+
+
+def test_result_events_pushes_transition(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        now = datetime.now(timezone.utc)
+        app.state.repo.create_processing_result(
+            result_id="pending-sse",
+            created_at=now.isoformat(),
+            expires_at=(now + timedelta(days=30)).isoformat(),
+            prompt_version="v1",
+            user_agent_hash=None,
+            client_request_id=None,
+            ip_hash=None,
+        )
+
+        def finish():
+            app.state.repo.mark_ready("pending-sse", "u", "g", "selfies/pending-sse/final.png", "p")
+            app.state.notifier.publish("pending-sse")
+
+        timer = threading.Timer(0.2, finish)
+        timer.start()
+        started = time.monotonic()
+        response = client.get("/api/selfie/result/pending-sse/events")
+        timer.join()
+
+        assert [p["status"] for p in _sse_payloads(response.text)] == ["processing", "ready"]
+        # Woken by the notification, not by the periodic recheck.
+        assert time.monotonic() - started < 2
+
+
+def test_result_events_unknown_result(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        assert client.get("/api/selfie/result/missing/events").status_code == 404
+
+
+def test_metrics_endpoint(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    with TestClient(create_app(validate_env=False)) as client:
+        # Off unless asked for: the public app should not expose queue and cache internals.
+        assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setenv("METRICS_ENABLED", "true")
+    monkeypatch.setenv("METRICS_TOKEN", "scrape-secret")
+    with TestClient(create_app(validate_env=False)) as client:
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "# TYPE selfie_stage_seconds histogram" in response.text
+        assert "selfie_jobs_queued 0" in response.text
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.services import cleanup
+from app.services.cleanup import delete_expired_results_once
+from app.services.results_repo import ResultsRepository
+
+
+class BatchStorage:
+    def __init__(self, fail_keys=()) -> None:
+        self.fail_keys = set(fail_keys)
+        self.batches: list[list[str]] = []
+
+    async def delete_objects(self, keys: list[str]) -> set[str]:
+        self.batches.append(list(keys))
+        return {key for key in keys if key not in self.fail_keys}
+
+
+def _seed_expired(repo: ResultsRepository, result_id: str, **derivative_keys: str) -> None:
+    past = datetime.now(timezone.utc) - timedelta(days=1)
+    repo.create_processing_result(
+        result_id=result_id,
+        created_at=(past - timedelta(days=30)).isoformat(),
+        expires_at=past.isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=None,
+        ip_hash=None,
+    )
+    repo.mark_ready(
+        result_id=result_id,
+        upload_object_key=f"selfies/{result_id}/upload.jpg",
+        generated_object_key=f"selfies/{result_id}/generated.jpg",
+        final_object_key=f"selfies/{result_id}/final.png",
+        public_image_url="",
+        **derivative_keys,
+    )
+
+
+def test_cleanup_batches_deletes_and_keeps_unconfirmed_rows(monkeypatch, tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    for i in range(5):
+        _seed_expired(repo, f"old-{i}")
+
+    monkeypatch.setattr(cleanup, "MAX_DELETE_BATCH", 4)
+    storage = BatchStorage(fail_keys={"selfies/old-2/generated.jpg"})
+
+    removed = asyncio.run(delete_expired_results_once(repo, storage))
+
+    assert removed == 4
+    assert [len(batch) for batch in storage.batches] == [4, 4, 4, 3]
+    assert repo.get_result("old-2") is not None
+    assert repo.get_result("old-0") is None
+
+
+def test_cleanup_sweeps_in_keyset_pages(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    for i in range(5):
+        _seed_expired(repo, f"old-{i}")
+    storage = BatchStorage(fail_keys={"selfies/old-0/final.png"})
+
+    removed = asyncio.run(delete_expired_results_once(repo, storage, page_size=2))
+
+    # The kept row must not stall the sweep: later pages start after it.
+    assert removed == 4
+    assert [len(batch) for batch in storage.batches] == [6, 6, 3]
+    assert [row.id for row in repo.get_expired_results_page(datetime.now(timezone.utc).isoformat(), 10)] == ["old-0"]
+
+
+def test_cleanup_deletes_image_derivatives(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _seed_expired(
+        repo,
+        "old-0",
+        thumbnail_object_key="selfies/old-0/thumb.webp",
+        social_card_object_key="selfies/old-0/card.jpg",
+    )
+    storage = BatchStorage()
+
+    assert asyncio.run(delete_expired_results_once(repo, storage)) == 1
+    assert {"selfies/old-0/thumb.webp", "selfies/old-0/card.jpg"} <= set(storage.batches[0])
@@ -0,0 +1,33 @@
+import asyncio
+import io
+
+from PIL import Image
+
+from app.services.cpu_pool import create_cpu_pool, run_cpu
+from app.services.image_pipeline import render_campaign_outputs
+
+
+def _jpeg_bytes(size=(800, 600), color=(10, 120, 160)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_render_campaign_outputs_in_process_pool(tmp_path):
+    frame_path = tmp_path / "frame.png"
+    Image.new("RGBA", (1024, 1024), (255, 128, 0, 40)).save(frame_path)
+
+    pool = create_cpu_pool(1, str(frame_path))
+    try:
+        outputs = asyncio.run(run_cpu(pool, render_campaign_outputs, _jpeg_bytes(), str(frame_path)))
+    finally:
+        pool.shutdown()
+
+    assert Image.open(io.BytesIO(outputs.final)).size == (1024, 1024)
+    assert Image.open(io.BytesIO(outputs.thumbnail)).size == (512, 512)
+    assert Image.open(io.BytesIO(outputs.social_card)).size == (1200, 630)
+
+
+def test_cpu_pool_disabled_runs_inline():
+    assert create_cpu_pool(0, "unused.png") is None
+    assert asyncio.run(run_cpu(None, sum, [1, 2, 3])) == 6
@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+from fal_client.client import FalClientHTTPError
+
+from app.clients import fal_client
+from app.clients.fal_client import FAL_CDN_TOKEN_URL, FAL_CDN_UPLOAD_URL, FAL_MODEL, FAL_QUEUE_URL, FalAPIClient
+
+REQUEST_URL = "https://queue.fal.run/fal-ai/nano-banana/requests/r1"
+
+
+def test_fal_client_submits_and_polls_over_its_own_session(monkeypatch):
+    monkeypatch.setattr(fal_client, "FAL_POLL_INTERVAL_SECONDS", 0)
+    requests: list[httpx.Request] = []
+    statuses = iter([{"status": "IN_QUEUE", "queue_position": 0}, {"status": "IN_PROGRESS", "logs": None}])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.method == "POST":
+            return httpx.Response(
+                200,
+                json={
+                    "request_id": "r1",
+                    "response_url": REQUEST_URL,
+                    "status_url": REQUEST_URL + "/status",
+                    "cancel_url": REQUEST_URL + "/cancel",
+                },
+            )
+        if request.url.path.endswith("/status"):
+            return httpx.Response(200, json=next(statuses, {"status": "COMPLETED", "logs": None}))
+        return httpx.Response(200, json={"images": [{"url": "https://fal.media/out.jpg"}]})
+
+    async def scenario() -> None:
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = FalAPIClient("test-key", http_client=http)
+        progress = []
+
+        async def on_progress(stage, position=None):
+            progress.append((stage, position))
+
+        url = await client.generate_firefighter_image(b"", "image/jpeg", on_progress, source_url="https://s3.example/in.jpg")
+        assert url == "https://fal.media/out.jpg"
+        assert progress == [("queued", 0), ("generating", None)]
+        await client.aclose()
+        assert http.is_closed
+
+    asyncio.run(scenario())
+    assert str(requests[0].url) == FAL_QUEUE_URL + FAL_MODEL
+    assert {request.headers["authorization"] for request in requests} == {"Key test-key"}
+
+
+def test_fal_client_uploads_on_its_session_and_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(fal_client, "FAL_POLL_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(fal_client, "FAL_RETRY_BASE_DELAY_SECONDS", 0)
+    requests: list[httpx.Request] = []
+    submits = iter([httpx.Response(502, text="nginx"), httpx.Response(429, json={"detail": "slow down"})])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if str(request.url) == FAL_CDN_TOKEN_URL:
+            return httpx.Response(
+                200,
+                json={"token": "cdn-token", "token_type": "Bearer", "base_url": "https://v3.fal.media", "expires_at": "2999-01-01T00:00:00+00:00"},
+            )
+        if str(request.url) == FAL_CDN_UPLOAD_URL:
+            return httpx.Response(200, json={"access_url": "https://v3.fal.media/files/in.jpg"})
+        if str(request.url) == FAL_QUEUE_URL + FAL_MODEL:
+            assert b"https://v3.fal.media/files/in.jpg" in request.content
+            return next(
+                submits,
+                httpx.Response(
+                    200,
+                    json={"request_id": "r1", "response_url": REQUEST_URL, "status_url": REQUEST_URL + "/status", "cancel_url": REQUEST_URL + "/cancel"},
+                ),
+            )
+        if request.url.path.endswith("/status"):
+            return httpx.Response(200, json={"status": "COMPLETED", "logs": None})
+        return httpx.Response(200, json={"images": [{"url": "https://fal.media/out.jpg"}]})
+
+    async def scenario() -> None:
+        client = FalAPIClient("test-key", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        assert await client.generate_firefighter_image(b"photo", "image/jpeg") == "https://fal.media/out.jpg"
+        await client.aclose()
+
+    asyncio.run(scenario())
+    upload = next(request for request in requests if str(request.url) == FAL_CDN_UPLOAD_URL)
+    assert (upload.headers["authorization"], upload.headers["content-type"], upload.content) == ("Bearer cdn-token", "image/jpeg", b"photo")
+    assert [str(request.url) for request in requests].count(FAL_QUEUE_URL + FAL_MODEL) == 3
+
+
+def test_fal_client_raises_fal_errors_and_does_not_retry_errors_from_fal():
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        # Reached fal, so not an ingress error.
+        return httpx.Response(503, json={"detail": "model unavailable"}, headers={"x-fal-request-id": "r1"})
+
+    async def scenario() -> None:
+        client = FalAPIClient("test-key", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        with pytest.raises(FalClientHTTPError) as excinfo:
+            await client.generate_firefighter_image(b"", "image/jpeg", source_url="https://s3.example/in.jpg")
+        await client.aclose()
+        return excinfo.value
+
+    error = asyncio.run(scenario())
+    assert (str(error), error.status_code) == ("model unavailable", 503)
+    assert len(requests) == 1
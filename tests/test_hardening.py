@@ -1,6 +1,8 @@
 import io
+import tempfile
 import time
 
+import pytest
 from fastapi.testclient import TestClient
 from PIL import Image
 
@@ -8,15 +10,21 @@ from app.main import create_app
 
 
 class DummyStorage:
-    def upload_bytes(self, key: str, data: bytes, content_type: str) -> str:
+    async def upload_bytes(self, key: str, data: bytes, content_type: str, cache_control: str | None = None) -> str:
         return f"https://example.com/{key}"
 
-    def delete_object(self, key: str) -> None:
+    async def delete_object(self, key: str) -> None:
         return None
 
+    async def delete_objects(self, keys: list[str]) -> set[str]:
+        return set(keys)
+
     def presigned_get_url(self, key: str, expires_in: int, download_filename: str | None = None) -> str:
         return "https://signed.example.com/object"
 
+    def close(self) -> None:
+        return None
+
 
 def _png_bytes(size=(700, 700), color=(20, 30, 40)) -> bytes:
     # Generate a non-flat image so variance-based validation passes.
@@ -61,16 +69,17 @@ def test_generate_returns_202_and_becomes_ready(monkeypatch, tmp_path):
     monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
     app = create_app(validate_env=False)
 
-    def fake_run(repo, storage, frame_asset_path, photo_path, content_type, upload_key, generated_key, final_key, result_id):
+    async def fake_run(repo, storage, settings, photo_bytes, content_type, upload_key, final_key, result_id, cpu_pool=None, **kwargs):
         repo.mark_ready(
             result_id=result_id,
             upload_object_key=upload_key,
-            generated_object_key=generated_key,
+            generated_object_key=f"selfies/{result_id}/generated.jpg",
             final_object_key=final_key,
             public_image_url="https://example.com/final.png",
         )
+        return {}
 
-    monkeypatch.setattr("app.services.job_runner._run_generation_sync", fake_run)
+    monkeypatch.setattr("app.services.job_runner._run_generation", fake_run)
 
     with TestClient(app) as client:
         app.state.storage = DummyStorage()
@@ -104,16 +113,17 @@ def test_idempotency_returns_same_result(monkeypatch, tmp_path):
     monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
     app = create_app(validate_env=False)
 
-    def fake_run(repo, storage, frame_asset_path, photo_path, content_type, upload_key, generated_key, final_key, result_id):
+    async def fake_run(repo, storage, settings, photo_bytes, content_type, upload_key, final_key, result_id, cpu_pool=None, **kwargs):
         repo.mark_ready(
             result_id=result_id,
             upload_object_key=upload_key,
-            generated_object_key=generated_key,
+            generated_object_key=f"selfies/{result_id}/generated.jpg",
             final_object_key=final_key,
             public_image_url="https://example.com/final.png",
         )
+        return {}
 
-    monkeypatch.setattr("app.services.job_runner._run_generation_sync", fake_run)
+    monkeypatch.setattr("app.services.job_runner._run_generation", fake_run)
 
     with TestClient(app) as client:
         app.state.storage = DummyStorage()
@@ -137,22 +147,26 @@ def test_idempotency_returns_same_result(monkeypatch, tmp_path):
         assert r2.json()["result_id"] == id1
 
 
-def test_rate_limit_triggers(monkeypatch, tmp_path):
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_rate_limit_triggers(monkeypatch, tmp_path, backend):
     monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    monkeypatch.setenv("RATE_LIMIT_BACKEND", backend)
+    monkeypatch.setenv("RATE_LIMIT_DB_PATH", str(tmp_path / "limits.db"))
     monkeypatch.setenv("RATE_LIMIT_PER_MIN", "3")
     monkeypatch.setenv("RATE_LIMIT_PER_DAY", "20")
     app = create_app(validate_env=False)
 
-    def fake_run(repo, storage, frame_asset_path, photo_path, content_type, upload_key, generated_key, final_key, result_id):
+    async def fake_run(repo, storage, settings, photo_bytes, content_type, upload_key, final_key, result_id, cpu_pool=None, **kwargs):
         repo.mark_ready(
             result_id=result_id,
             upload_object_key=upload_key,
-            generated_object_key=generated_key,
+            generated_object_key=f"selfies/{result_id}/generated.jpg",
             final_object_key=final_key,
             public_image_url="https://example.com/final.png",
         )
+        return {}
 
-    monkeypatch.setattr("app.services.job_runner._run_generation_sync", fake_run)
+    monkeypatch.setattr("app.services.job_runner._run_generation", fake_run)
 
     with TestClient(app) as client:
         app.state.storage = DummyStorage()
@@ -173,3 +187,48 @@ def test_rate_limit_triggers(monkeypatch, tmp_path):
         )
         assert r4.status_code == 429
         assert "Retry-After" in r4.headers
+
+        # Finished jobs leave the queue and hand back their run slots.
+        deadline = time.time() + 2.0
+        while (app.state.repo.count_jobs() or len(app.state.gen_run_slots)) and time.time() < deadline:
+            time.sleep(0.02)
+        assert app.state.repo.count_jobs() == 0
+        assert len(app.state.gen_run_slots) == 0
+
+
+def test_generate_hands_upload_bytes_to_job(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    app = create_app(validate_env=False)
+    received = {}
+
+    async def fake_run(repo, storage, settings, photo_bytes, content_type, upload_key, final_key, result_id, cpu_pool=None, **kwargs):
+        received["photo_bytes"] = photo_bytes
+        received["upload_key"] = upload_key
+        return {}
+
+    monkeypatch.setattr("app.services.job_runner._run_generation", fake_run)
+    spooled_to_disk = []
+    monkeypatch.setattr(tempfile.SpooledTemporaryFile, "rollover", lambda self: spooled_to_disk.append(self))
+
+    # Noise does not compress, so this is well past Starlette's default 1 MiB spool size.
+    buf = io.BytesIO()
+    Image.effect_noise((800, 800), 80).convert("RGB").save(buf, format="PNG")
+    photo = buf.getvalue()
+    assert len(photo) > 1024 * 1024
+    with TestClient(app) as client:
+        app.state.storage = DummyStorage()
+        response = client.post(
+            "/api/selfie/generate",
+            headers={"Origin": "http://localhost:8000"},
+            data={"client_request_id": "req-bytes"},
+            files={"photo": ("photo.png", photo, "image/png")},
+        )
+        assert response.status_code == 202
+
+        deadline = time.time() + 2.0
+        while "photo_bytes" not in received and time.time() < deadline:
+            time.sleep(0.02)
+
+    assert received["photo_bytes"] == photo
+    assert received["upload_key"].endswith("/upload.png")
+    assert spooled_to_disk == []
@@ -1,8 +1,21 @@
+import asyncio
 import io
+from pathlib import Path
 
-from PIL import Image
+import httpx
+import pytest
+from PIL import Image, ImageChops, ImageStat
 
-from app.services.image_pipeline import ValidationError, build_final_campaign_image, validate_upload_bytes
+from app.services.image_pipeline import (
+    FrameRegistry,
+    ValidationError,
+    _resize_rgba_premultiplied,
+    build_campaign_outputs,
+    campaign_frame_paths,
+    detect_output_format,
+    download_generated_bytes,
+    validate_upload_bytes,
+)
 
 
 def _make_image_bytes(size=(600, 600), color=(120, 90, 40), fmt="PNG"):
@@ -32,14 +45,170 @@ def test_validate_rejects_small_image():
         raise AssertionError("Expected ValidationError")
 
 
-def test_build_final_campaign_image_outputs_1024_square(tmp_path):
+def test_campaign_final_image_is_1024_square(tmp_path):
     frame_path = tmp_path / "frame.png"
     frame = Image.new("RGBA", (1024, 1024), (255, 128, 0, 40))
     frame.save(frame_path)
 
     source = Image.new("RGB", (1600, 900), (10, 120, 160))
-    output = build_final_campaign_image(source, str(frame_path))
+    output = build_campaign_outputs(source, str(frame_path)).final
 
     result = Image.open(io.BytesIO(output))
     assert result.size == (1024, 1024)
     assert result.mode == "RGBA"
+
+
+def test_campaign_final_image_selectable_formats(tmp_path):
+    frame_path = tmp_path / "frame.png"
+    Image.new("RGBA", (1024, 1024), (255, 128, 0, 40)).save(frame_path)
+    source = Image.new("RGB", (900, 900), (10, 120, 160))
+
+    for name, pil_format in (("webp", "WEBP"), ("jpeg", "JPEG")):
+        output = build_campaign_outputs(source, str(frame_path), output_format=name).final
+        result = Image.open(io.BytesIO(output))
+        assert result.format == pil_format
+        assert result.size == (1024, 1024)
+        assert detect_output_format(output).name == name
+
+    assert detect_output_format(b"not an image") is None
+
+
+def _reference_resize_rgba_premultiplied(image, size, resample):
+    # Original per-pixel implementation, kept as the parity baseline.
+    r, g, b, a = image.convert("RGBA").split()
+    channels = [ImageChops.multiply(c, a).resize(size, resample=resample) for c in (r, g, b)]
+    a = a.resize(size, resample=resample)
+    ab = a.tobytes()
+    out = []
+    for channel in channels:
+        cb = channel.tobytes()
+        buf = bytearray(len(ab))
+        for i, alpha in enumerate(ab):
+            if alpha:
+                buf[i] = min(255, (cb[i] * 255) // alpha)
+        out.append(Image.frombytes("L", size, bytes(buf)))
+    return Image.merge("RGBA", (*out, a))
+
+
+def test_resize_rgba_premultiplied_matches_reference():
+    frame = Image.new("RGBA", (300, 300))
+    pixels = frame.load()
+    for y in range(300):
+        for x in range(300):
+            alpha = 0 if (x // 20 + y // 20) % 3 == 0 else (x + y) % 256
+            pixels[x, y] = ((x * 7) % 256, (y * 3) % 256, (x * y) % 256, alpha)
+
+    size = (128, 128)
+    expected = _reference_resize_rgba_premultiplied(frame, size, Image.Resampling.LANCZOS)
+    actual = _resize_rgba_premultiplied(frame, size, Image.Resampling.LANCZOS)
+
+    assert actual.mode == "RGBA"
+    assert actual.getchannel("A").tobytes() == expected.getchannel("A").tobytes()
+
+    # Colour may differ by rounding only; compare as composited over a backdrop.
+    backdrop = Image.new("RGBA", size, (0, 0, 0, 255))
+    diff = ImageChops.difference(
+        Image.alpha_composite(backdrop, actual),
+        Image.alpha_composite(backdrop, expected),
+    )
+    assert max(high for _, high in diff.getextrema()) <= 3
+
+
+def test_frame_registry_precomputes_variants_and_evicts(tmp_path):
+    frame_path = tmp_path / "frame_v1.png"
+    Image.new("RGBA", (1024, 1024), (255, 0, 0, 128)).save(frame_path)
+    Image.new("RGBA", (1024, 1024), (0, 255, 0, 128)).save(tmp_path / "frame_v2.png")
+
+    paths = campaign_frame_paths(str(frame_path))
+    assert paths == [str(frame_path), str(tmp_path / "frame_v2.png")]
+
+    registry = FrameRegistry(max_entries=4)
+    registry.preload(paths, sizes=(1024, 512))
+    assert len(registry) == 4
+    assert registry.get(str(frame_path), 512).size == (512, 512)
+
+    registry.get(str(frame_path), 630)
+    assert len(registry) == 4
+
+
+def test_frame_registry_reload_picks_up_new_asset(tmp_path):
+    frame_path = tmp_path / "frame.png"
+    Image.new("RGBA", (64, 64), (255, 0, 0, 255)).save(frame_path)
+
+    registry = FrameRegistry()
+    registry.preload([str(frame_path)], sizes=(32,))
+    Image.new("RGBA", (64, 64), (0, 0, 255, 255)).save(frame_path)
+    # No per-call stat: the cached variant is served until an explicit reload.
+    assert registry.get(str(frame_path), 32).getpixel((0, 0)) == (255, 0, 0, 255)
+
+    registry.reload()
+    assert registry.get(str(frame_path), 32).getpixel((0, 0)) == (0, 0, 255, 255)
+
+
+def _reference_accepts(data):
+    # Original full-decode validation rule.
+    try:
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+    except Exception:
+        return False
+    if image.width < 512 or image.height < 512:
+        return False
+    return ImageStat.Stat(image.convert("L")).var[0] >= 8
+
+
+def _fine_noise_jpeg(amplitude):
+    # Pixel-level checkerboard: high full-size variance, near-zero variance once averaged.
+    image = Image.new("L", (640, 640))
+    pixels = image.load()
+    for y in range(640):
+        for x in range(640):
+            pixels[x, y] = 128 + (amplitude if (x + y) % 2 else -amplitude)
+    buf = io.BytesIO()
+    image.convert("RGB").save(buf, format="JPEG", quality=100)
+    return buf.getvalue()
+
+
+def test_validate_reduced_decode_keeps_reference_decisions():
+    photo = (Path(__file__).parent.parent / "test" / "images" / "A.jpg").read_bytes()
+    cases = [
+        photo,
+        photo[: len(photo) // 2],
+        _make_image_bytes(fmt="JPEG"),
+        _make_image_bytes(size=(400, 900), fmt="JPEG"),
+        _fine_noise_jpeg(2),
+        _fine_noise_jpeg(6),
+    ]
+    for data in cases:
+        try:
+            validate_upload_bytes(data, "image/jpeg")
+            accepted = True
+        except ValidationError:
+            accepted = False
+        assert accepted == _reference_accepts(data)
+
+
+def test_download_generated_bytes_streams_with_size_limit():
+    body = _make_image_bytes(fmt="JPEG")
+    seen = []
+
+    async def chunks():
+        yield body[:1000]
+        yield body[1000:]
+
+    def handler(request):
+        seen.append(request.url.path)
+        if request.url.path == "/chunked.jpg":
+            # No Content-Length: the limit has to be enforced while streaming.
+            return httpx.Response(200, content=chunks())
+        return httpx.Response(200, content=body)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            assert await download_generated_bytes("https://cdn.example/ok.jpg", client) == body
+            with pytest.raises(ValueError):
+                await download_generated_bytes("https://cdn.example/ok.jpg", client, max_bytes=len(body) - 1)
+            with pytest.raises(ValueError):
+                await download_generated_bytes("https://cdn.example/chunked.jpg", client, max_bytes=1500)
+
+    asyncio.run(run())
+    assert seen == ["/ok.jpg", "/ok.jpg", "/chunked.jpg"]
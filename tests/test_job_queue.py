@@ -0,0 +1,56 @@
+import socket
+from datetime import datetime, timedelta, timezone
+
+from app.services.job_queue import requeue_orphaned_jobs
+from app.services.ownership import worker_identity
+from app.services.results_repo import ResultsRepository
+
+# A pid far above any default pid_max, so it never names a live process.
+DEAD_OWNER = f"{socket.gethostname()}:99999999:dead"
+
+
+def _queue(repo: ResultsRepository, result_id: str, origin: str) -> None:
+    now = datetime.now(timezone.utc)
+    assert repo.create_queued_result(
+        result_id=result_id,
+        created_at=now.isoformat(),
+        expires_at=(now + timedelta(days=30)).isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=result_id,
+        ip_hash="ip",
+        upload_object_key=f"selfies/{result_id}/upload.jpg",
+        content_type="image/jpeg",
+        origin=origin,
+        max_queue=10,
+        now=0.0,
+    )
+
+
+def test_requeue_resumes_stored_and_fails_lost_jobs(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    owner = worker_identity()
+
+    # Running in a dead process with its upload stored: resumable.
+    _queue(repo, "stored", DEAD_OWNER)
+    repo.mark_job_upload_stored("stored")
+    repo.claim_job(DEAD_OWNER, now=1.0, lease_seconds=10**12)
+    # Running in a dead process, upload only ever in its memory: lost.
+    _queue(repo, "lost", DEAD_OWNER)
+    repo.claim_job(DEAD_OWNER, now=1.0, lease_seconds=10**12)
+    # Queued by this process: untouched.
+    _queue(repo, "mine", owner)
+    # Processing with no job at all.
+    now = datetime.now(timezone.utc)
+    repo.create_processing_result("legacy", now.isoformat(), (now + timedelta(days=1)).isoformat(), "v1", None, None, None)
+
+    assert requeue_orphaned_jobs(repo, owner, max_attempts=2) == (1, 2)
+
+    resumed = repo.get_job("stored")
+    assert resumed.lease_owner is None
+    assert repo.claim_job(owner, now=2.0, lease_seconds=60).result_id in {"stored", "mine"}
+    assert repo.get_job("lost") is None
+    assert repo.get_result("lost").internal_error_code == "INTERRUPTED"
+    assert repo.get_result("legacy").status == "failed"
+    assert repo.get_result("mine").status == "processing"
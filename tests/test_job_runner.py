@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from PIL import Image
+
+from app.clients.fal_client import FakeFalClient
+from app.services import job_runner
+from app.services.results_repo import ResultsRepository
+
+
+def _image_bytes(fmt: str = "JPEG") -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 640), (200, 80, 20)).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+class SlowStorage:
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.objects: dict[str, tuple[bytes, str]] = {}
+
+    async def upload_bytes(self, key: str, data: bytes, content_type: str, cache_control: str | None = None) -> str:
+        await asyncio.sleep(self.delay)
+        self.objects[key] = (data, content_type)
+        return f"https://example.com/{key}"
+
+
+class DeletingSlowStorage(SlowStorage):
+    async def delete_objects(self, keys: list[str]) -> set[str]:
+        for key in keys:
+            self.objects.pop(key, None)
+        return set(keys)
+
+
+class SignedSlowStorage(SlowStorage):
+    def presigned_get_url(self, key: str, expires_in: int, download_filename: str | None = None) -> str:
+        assert key in self.objects, "fal must not be pointed at an object before it is stored"
+        return f"https://signed.example/{key}?ttl={expires_in}"
+
+
+class Rendezvous:
+    """
+    Pairs of operations that each wait for the other to start. A pair run one
+    after the other never meets and times out, so overlap is checked without timing.
+    """
+
+    def __init__(self, *pairs: tuple[str, str]) -> None:
+        self.peers = {a: b for a, b in pairs} | {b: a for a, b in pairs}
+        self.started = {name: asyncio.Event() for name in self.peers}
+
+    async def meet(self, name: str) -> None:
+        if name not in self.peers:
+            return
+        self.started[name].set()
+        await asyncio.wait_for(self.started[self.peers[name]].wait(), timeout=5)
+
+
+class RendezvousStorage(SlowStorage):
+    def __init__(self, rendezvous: Rendezvous) -> None:
+        super().__init__(delay=0)
+        self.rendezvous = rendezvous
+
+    async def upload_bytes(self, key: str, data: bytes, content_type: str, cache_control: str | None = None) -> str:
+        await self.rendezvous.meet(key)
+        return await super().upload_bytes(key, data, content_type, cache_control)
+
+
+class RendezvousFal:
+    def __init__(self, rendezvous: Rendezvous) -> None:
+        self.rendezvous = rendezvous
+
+    async def generate_firefighter_image(self, source: bytes, content_type: str, on_progress=None, source_url=None) -> str:
+        await self.rendezvous.meet("fal")
+        return "https://fal.example/generated.jpg"
+
+
+def _returning(data: bytes):
+    async def download(url: str, client=None) -> bytes:
+        return data
+
+    return download
+
+
+def _seed(repo: ResultsRepository, result_id: str) -> None:
+    now = datetime.now(timezone.utc)
+    repo.create_processing_result(
+        result_id=result_id,
+        created_at=now.isoformat(),
+        expires_at=(now + timedelta(days=30)).isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=None,
+        ip_hash=None,
+    )
+
+
+def test_run_generation_overlaps_independent_stages(monkeypatch, tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _seed(repo, "job-1")
+
+    frame_path = tmp_path / "frame.png"
+    Image.new("RGBA", (1024, 1024), (255, 128, 0, 40)).save(frame_path)
+    settings = SimpleNamespace(frame_asset_path=str(frame_path), final_image_format="png", fal_source="upload", image_delivery="signed")
+    generated = _image_bytes()
+
+    # fal || original PUT, then generated PUT || (compose + final PUT).
+    rendezvous = Rendezvous(
+        ("fal", "selfies/job-1/upload.jpg"),
+        ("selfies/job-1/generated.jpg", "selfies/job-1/final.png"),
+    )
+    monkeypatch.setattr(job_runner, "create_fal_client", lambda settings: RendezvousFal(rendezvous))
+    monkeypatch.setattr(job_runner, "download_generated_bytes", _returning(generated))
+    storage = RendezvousStorage(rendezvous)
+
+    timings = asyncio.run(
+        job_runner._run_generation(
+            repo, storage, settings, b"original", "image/jpeg",
+            "selfies/job-1/upload.jpg", "selfies/job-1/final.png", "job-1",
+        )
+    )
+
+    assert {"upload_original", "fal_generate", "download_generated", "compose", "upload_final", "upload_generated"} <= set(timings)
+    assert storage.objects["selfies/job-1/generated.jpg"] == (generated, "image/jpeg")
+    row = repo.get_result("job-1")
+    assert row.status == "ready"
+    assert (row.thumbnail_object_key, row.social_card_object_key) == ("selfies/job-1/thumb.webp", "selfies/job-1/card.jpg")
+    assert storage.objects[row.thumbnail_object_key][1] == "image/webp"
+    assert storage.objects[row.social_card_object_key][1] == "image/jpeg"
+
+
+def test_storage_source_hands_fal_the_stored_upload(monkeypatch, tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _seed(repo, "job-4")
+
+    frame_path = tmp_path / "frame.png"
+    Image.new("RGBA", (1024, 1024), (255, 128, 0, 40)).save(frame_path)
+    settings = SimpleNamespace(
+        frame_asset_path=str(frame_path),
+        final_image_format="png",
+        fal_source="storage",
+        fal_job_timeout_seconds=300,
+        image_delivery="public",
+    )
+    # fal answered with a PNG although a JPEG was asked for.
+    generated = _image_bytes("PNG")
+    source_urls = []
+
+    class RecordingFal:
+        async def generate_firefighter_image(self, source, content_type, on_progress=None, source_url=None):
+            source_urls.append(source_url)
+            return "https://fal.example/generated.jpg"
+
+    monkeypatch.setattr(job_runner, "download_generated_bytes", _returning(generated))
+    storage = SignedSlowStorage(delay=0)
+
+    asyncio.run(
+        job_runner._run_generation(
+            repo, storage, settings, b"original", "image/jpeg",
+            "selfies/job-4/upload.jpg", "selfies/job-4/final.png", "job-4",
+            fal=RecordingFal(),
+        )
+    )
+
+    assert source_urls == ["https://signed.example/selfies/job-4/upload.jpg?ttl=300"]
+    assert storage.objects["selfies/job-4/upload.jpg"] == (b"original", "image/jpeg")
+    row = repo.get_result("job-4")
+    assert row.status == "ready"
+    assert row.generated_object_key == "selfies/job-4/generated.png"
+    assert storage.objects[row.generated_object_key] == (generated, "image/png")
+    # Public delivery stores the final image under a content-addressed key.
+    final_bytes, _ = storage.objects[row.final_object_key]
+    assert row.final_object_key == f"selfies/job-4/final-{hashlib.sha256(final_bytes).hexdigest()[:16]}.png"
+    assert row.public_image_url == f"https://example.com/{row.final_object_key}"
+
+
+def test_run_finishing_after_timeout_deletes_what_it_stored(monkeypatch, tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _seed(repo, "job-5")
+
+    frame_path = tmp_path / "frame.png"
+    Image.new("RGBA", (1024, 1024), (255, 128, 0, 40)).save(frame_path)
+    settings = SimpleNamespace(frame_asset_path=str(frame_path), final_image_format="png", fal_source="upload", image_delivery="signed")
+    storage = DeletingSlowStorage(delay=0)
+
+    class TimingOutFal:
+        async def generate_firefighter_image(self, source, content_type, on_progress=None, source_url=None):
+            # The status endpoint times the result out while fal is still working.
+            repo.mark_failed("job-5", "Timed out. Please try again.", internal_error_code="TIMED_OUT")
+            return "https://fal.example/generated.jpg"
+
+    monkeypatch.setattr(job_runner, "download_generated_bytes", _returning(_image_bytes()))
+    asyncio.run(
+        job_runner._run_generation(
+            repo, storage, settings, b"original", "image/jpeg",
+            "selfies/job-5/upload.jpg", "selfies/job-5/final.png", "job-5",
+            fal=TimingOutFal(),
+        )
+    )
+
+    assert repo.get_result("job-5").internal_error_code == "TIMED_OUT"
+    assert storage.objects == {}
+
+
+def test_failed_job_is_retried_with_backoff_then_failed(monkeypatch, tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    now = datetime.now(timezone.utc)
+    repo.create_queued_result(
+        result_id="job-2",
+        created_at=now.isoformat(),
+        expires_at=(now + timedelta(days=30)).isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=None,
+        ip_hash=None,
+        upload_object_key="selfies/job-2/upload.jpg",
+        content_type="image/jpeg",
+        origin="web-1",
+        max_queue=10,
+        now=time.time(),
+    )
+    published = []
+    app = SimpleNamespace(
+        state=SimpleNamespace(
+            settings=SimpleNamespace(final_image_format="png", gen_job_max_attempts=2, gen_job_retry_backoff_seconds=30),
+            repo=repo,
+            storage=SlowStorage(delay=0),
+            cpu_pool=None,
+            fal_client=None,
+            http_client=None,
+            notifier=SimpleNamespace(publish=published.append),
+        )
+    )
+
+    async def failing_run(*args, **kwargs):
+        raise RuntimeError("fal unavailable")
+
+    monkeypatch.setattr(job_runner, "_run_generation", failing_run)
+
+    job = repo.claim_job("web-1", now=time.time(), lease_seconds=60)
+    assert asyncio.run(job_runner.run_generation_job(app, job, b"original")) is False
+    retry = repo.get_job("job-2")
+    assert retry.lease_owner is None
+    assert retry.available_at >= time.time() + 25
+    assert repo.get_result("job-2").status == "processing"
+
+    job = repo.claim_job("web-1", now=retry.available_at, lease_seconds=60)
+    assert job.attempts == 2
+    assert asyncio.run(job_runner.run_generation_job(app, job, b"original")) is True
+    assert repo.get_job("job-2") is None
+    assert repo.get_result("job-2").status == "failed"
+    assert published == ["job-2", "job-2"]
+    # The last attempt's timings are kept on the result for post-mortems.
+    assert set(json.loads(repo.get_result("job-2").stage_timings)) == {"queue_wait"}
+
+
+def test_fake_fal_progress_is_persisted_on_the_result(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _seed(repo, "job-3")
+    published = []
+    report = job_runner._progress_reporter(repo, SimpleNamespace(publish=published.append), "job-3")
+    seen = []
+
+    async def on_progress(stage, queue_position=None):
+        await report(stage, queue_position)
+        row = repo.get_result("job-3")
+        seen.append((row.progress_stage, row.queue_position))
+
+    url = asyncio.run(FakeFalClient(queue_depth=2).generate_firefighter_image(_image_bytes(), "image/jpeg", on_progress))
+    assert url.startswith("data:image/")
+    assert seen == [("queued", 1), ("queued", 0), ("generating", None)]
+    assert published == ["job-3"] * 3
+
+    # Repeats are not re-published.
+    asyncio.run(report("generating", None))
+    assert len(published) == 3
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from app.services.metrics import Histogram, render_prometheus, span, state_metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", "stage", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe("fal", value)
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="fal",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="fal",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="fal",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="fal"} 4' in lines
+    assert histogram.snapshot("fal") == (4, 4.05)
+    assert histogram.snapshot("missing") == (0, 0.0)
+
+
+def test_span_records_into_timings_even_on_error():
+    timings: dict[str, float] = {}
+    try:
+        with span("test_failing_stage", timings):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+
+    assert timings["test_failing_stage"] >= 0
+    assert 'selfie_stage_seconds_count{stage="test_failing_stage"} 1' in render_prometheus()
+
+
+def test_state_metrics_skips_parts_the_process_does_not_run():
+    gauges, counters = state_metrics(SimpleNamespace(gen_run_slots={"a": 1}, storage=SimpleNamespace(presign_hits=3, presign_misses=1)))
+    assert gauges == {"selfie_run_slots_in_use": ("Generation run slots held.", 1)}
+    assert counters["selfie_presign_cache_hits_total"][1] == 3
+
+    text = render_prometheus(gauges, counters)
+    assert "# TYPE selfie_run_slots_in_use gauge\nselfie_run_slots_in_use 1\n" in text
+    assert "selfie_presign_cache_misses_total 1\n" in text
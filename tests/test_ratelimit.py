@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from app.services.ratelimit import (
+    BUSY_TIMEOUT_SECONDS,
+    DAY_WINDOW,
+    InProcessRateLimiter,
+    RateLimitExceeded,
+    SqliteRateLimiter,
+    open_shared_state_db,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_minute_limit_and_sliding_recovery():
+    clock = FakeClock(now=1_000_040.0)  # 20s into a minute window
+    limiter = InProcessRateLimiter(per_minute=3, per_day=20, clock=clock)
+    for _ in range(3):
+        limiter.check("ip")
+
+    with pytest.raises(RateLimitExceeded) as exc:
+        limiter.check("ip")
+    assert 1 <= exc.value.retry_after_seconds <= 60
+
+    # The previous window still weighs in shortly after it ends...
+    clock.now += 45
+    with pytest.raises(RateLimitExceeded):
+        limiter.check("ip")
+    # ...and has decayed far enough by the advertised retry time.
+    clock.now += 60
+    limiter.check("ip")
+
+
+def test_day_limit_uses_day_retry_floor():
+    clock = FakeClock()
+    limiter = InProcessRateLimiter(per_minute=100, per_day=2, clock=clock)
+    limiter.check("ip")
+    limiter.check("ip")
+    with pytest.raises(RateLimitExceeded) as exc:
+        limiter.check("ip")
+    assert exc.value.retry_after_seconds >= 60
+
+
+def test_retry_after_is_accurate():
+    clock = FakeClock(now=1_000_040.0)
+    limiter = InProcessRateLimiter(per_minute=3, per_day=20, clock=clock)
+    for _ in range(3):
+        limiter.check("ip")
+    with pytest.raises(RateLimitExceeded) as exc:
+        limiter.check("ip")
+
+    clock.now += exc.value.retry_after_seconds + 1
+    limiter.check("ip")
+
+
+def test_idle_keys_evicted_and_key_count_capped():
+    clock = FakeClock()
+    limiter = InProcessRateLimiter(per_minute=3, per_day=20, max_keys=3, clock=clock)
+    for i in range(5):
+        limiter.check(f"ip-{i}")
+    assert len(limiter) == 3
+
+    clock.now += DAY_WINDOW / 2
+    limiter.check("ip-4")
+    clock.now += DAY_WINDOW / 2 + 1
+    assert limiter.evict_idle() == 2
+    assert len(limiter) == 1
+
+
+def test_sqlite_limiter_is_shared_between_instances(tmp_path):
+    # Two instances on one database stand in for two gunicorn workers.
+    clock = FakeClock(now=1_000_040.0)
+    db_path = str(tmp_path / "limits.db")
+    first = SqliteRateLimiter(db_path, per_minute=3, per_day=20, clock=clock)
+    second = SqliteRateLimiter(db_path, per_minute=3, per_day=20, clock=clock)
+    try:
+        first.check("ip")
+        second.check("ip")
+        first.check("ip")
+        with pytest.raises(RateLimitExceeded):
+            second.check("ip")
+        second.check("other-ip")
+
+        clock.now += 120
+        first.check("ip")
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sqlite_limiter_evicts_idle_and_caps_keys(tmp_path):
+    clock = FakeClock()
+    limiter = SqliteRateLimiter(str(tmp_path / "limits.db"), per_minute=3, per_day=20, max_keys=3, clock=clock)
+    try:
+        for i in range(5):
+            clock.now += 1
+            limiter.check(f"ip-{i}")
+        assert limiter.evict_idle() == 2
+        assert len(limiter) == 3
+
+        clock.now += DAY_WINDOW
+        assert limiter.evict_idle() == 3
+        assert len(limiter) == 0
+    finally:
+        limiter.close()
+
+
+def test_sqlite_limiter_waits_for_the_write_lock_off_the_event_loop(tmp_path):
+    async def scenario() -> None:
+        db_path = str(tmp_path / "limits.db")
+        limiter = SqliteRateLimiter(db_path, per_minute=3, per_day=20)
+        # Another worker process holding the write lock.
+        other = open_shared_state_db(db_path)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            check = asyncio.create_task(limiter.acheck("ip"))
+            # The loop keeps running while the check waits for the lock.
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+            assert not check.done()
+            other.execute("COMMIT")
+            await asyncio.wait_for(check, BUSY_TIMEOUT_SECONDS)
+            assert len(limiter) == 1
+        finally:
+            other.close()
+            limiter.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.result_cache import CachedResultsRepository, ResultCache
+from app.services.results_repo import ResultsRepository
+
+
+def _create(repo, result_id: str) -> None:
+    now = datetime.now(timezone.utc)
+    repo.create_processing_result(
+        result_id=result_id,
+        created_at=now.isoformat(),
+        expires_at=(now + timedelta(days=30)).isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=None,
+        ip_hash=None,
+    )
+
+
+def test_polls_served_from_cache_and_transitions_write_through(monkeypatch, tmp_path):
+    cache = ResultCache(max_entries=10, ttl_seconds=60, processing_ttl_seconds=60)
+    repo = CachedResultsRepository(str(tmp_path / "results.db"), cache)
+    repo.init_db()
+    _create(repo, "r1")
+
+    reads = []
+    original = ResultsRepository.get_result
+    monkeypatch.setattr(ResultsRepository, "get_result", lambda self, rid: reads.append(rid) or original(self, rid))
+
+    assert repo.get_result("r1").status == "processing"
+    assert reads == []
+
+    repo.mark_ready(
+        result_id="r1",
+        upload_object_key="u",
+        generated_object_key="g",
+        final_object_key="f",
+        public_image_url="p",
+    )
+    reads.clear()
+    assert repo.get_result("r1").status == "ready"
+    assert reads == []
+    assert cache.hits == 2
+
+    repo.delete_results(["r1"])
+    assert repo.get_result("r1") is None
+
+
+def test_result_cache_lru_and_ttl(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    for result_id in ("a", "b", "c"):
+        _create(repo, result_id)
+
+    cache = ResultCache(max_entries=2, ttl_seconds=60, processing_ttl_seconds=0)
+    cache.put(repo.get_result("a"))
+    assert cache.get("a") is None  # processing rows with a zero TTL are never served
+
+    cache = ResultCache(max_entries=2, ttl_seconds=60, processing_ttl_seconds=60)
+    for result_id in ("a", "b"):
+        cache.put(repo.get_result(result_id))
+    cache.get("a")
+    cache.put(repo.get_result("c"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert len(cache) == 2
@@ -1,3 +1,5 @@
+import sqlite3
+import threading
 from datetime import datetime, timedelta, timezone
 
 from app.services.results_repo import ResultsRepository
@@ -33,5 +35,138 @@ def test_result_persistence_and_expiry(tmp_path):
     assert row.status == "ready"
     assert row.public_image_url.endswith("final.png")
 
-    expired_rows = repo.get_expired_results((now - timedelta(days=1)).isoformat())
-    assert expired_rows == []
+    assert repo.get_expired_results_page((now - timedelta(days=1)).isoformat(), limit=10) == []
+    assert [r.id for r in repo.get_expired_results_page((now + timedelta(days=31)).isoformat(), limit=10)] == ["abc123"]
+
+
+def test_pooled_repository_reuses_wal_connection_per_thread(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+
+    conn = repo._connect()
+    assert repo._connect() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(repo._connect()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    repo.close()
+    assert repo._connect() is not conn
+
+
+def test_unpooled_repository_reads_migrated_column_order(tmp_path):
+    db = tmp_path / "legacy.db"
+    with sqlite3.connect(db) as conn:
+        # Older schema: later columns were appended by migration in a different order.
+        conn.execute(
+            """
+            CREATE TABLE selfie_results (
+                id TEXT PRIMARY KEY, created_at TEXT NOT NULL, expires_at TEXT NOT NULL,
+                status TEXT NOT NULL, upload_object_key TEXT, generated_object_key TEXT,
+                final_object_key TEXT, public_image_url TEXT, prompt_version TEXT NOT NULL,
+                moderation_status TEXT NOT NULL, error_message TEXT, user_agent_hash TEXT
+            )
+            """
+        )
+    repo = ResultsRepository(str(db), pooled=False)
+    repo.init_db()
+    now = datetime.now(timezone.utc)
+    repo.create_processing_result("r1", now.isoformat(), (now + timedelta(days=1)).isoformat(), "v1", "ua", "req", "ip")
+
+    row = repo.get_result("r1")
+    assert (row.user_agent_hash, row.client_request_id, row.ip_hash) == ("ua", "req", "ip")
+
+
+def _queue(repo: ResultsRepository, result_id: str, origin: str = "host:1:a", max_queue: int = 10, now: float = 1000.0) -> bool:
+    created = datetime.now(timezone.utc)
+    return repo.create_queued_result(
+        result_id=result_id,
+        created_at=created.isoformat(),
+        expires_at=(created + timedelta(days=30)).isoformat(),
+        prompt_version="v1",
+        user_agent_hash=None,
+        client_request_id=result_id,
+        ip_hash="ip",
+        upload_object_key=f"selfies/{result_id}/upload.jpg",
+        content_type="image/jpeg",
+        origin=origin,
+        max_queue=max_queue,
+        now=now,
+    )
+
+
+def test_queue_admission_is_bounded_by_queued_jobs(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+
+    assert _queue(repo, "j1", max_queue=2)
+    assert _queue(repo, "j2", max_queue=2)
+    assert not _queue(repo, "j3", max_queue=2)
+    assert repo.get_result("j3") is None
+    assert repo.get_result("j1").status == "processing"
+
+    repo.complete_job("j1")
+    assert _queue(repo, "j3", max_queue=2)
+    assert repo.count_jobs() == 2
+
+
+def test_claim_leases_and_retry_backs_off(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _queue(repo, "j1", origin="web-1", now=1000.0)
+
+    # Only the origin holds the upload bytes until they are stored.
+    assert repo.claim_job("web-2", now=1001.0, lease_seconds=60) is None
+    job = repo.claim_job("web-1", now=1001.0, lease_seconds=60)
+    assert (job.result_id, job.attempts, job.lease_owner) == ("j1", 1, "web-1")
+    assert repo.claim_job("web-1", now=1002.0, lease_seconds=60) is None
+
+    repo.mark_job_upload_stored("j1")
+    repo.retry_job("j1", available_at=1010.0, error="boom")
+    assert repo.claim_job("web-2", now=1005.0, lease_seconds=60) is None
+    job = repo.claim_job("web-2", now=1010.0, lease_seconds=60)
+    assert (job.attempts, job.upload_stored, job.last_error) == (2, True, "boom")
+
+    # An expired lease is claimable again.
+    assert repo.claim_job("web-1", now=1071.0, lease_seconds=60).attempts == 3
+
+
+def test_fail_orphaned_results_skips_queued(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    now = datetime.now(timezone.utc)
+    repo.create_processing_result("legacy", now.isoformat(), (now + timedelta(days=1)).isoformat(), "v1", None, None, None)
+    _queue(repo, "queued")
+
+    assert repo.fail_orphaned_results("Interrupted", "INTERRUPTED") == ["legacy"]
+    assert repo.get_result("legacy").status == "failed"
+    assert repo.get_result("queued").status == "processing"
+
+
+def test_claim_drops_jobs_of_results_no_longer_processing(tmp_path):
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    repo.init_db()
+    _queue(repo, "timed-out", origin="web-1", now=1000.0)
+    _queue(repo, "live", origin="web-1", now=1001.0)
+    repo.mark_failed("timed-out", "Timed out. Please try again.", internal_error_code="TIMED_OUT")
+
+    assert repo.claim_job("web-1", now=1002.0, lease_seconds=60).result_id == "live"
+    assert repo.get_job("timed-out") is None
+    # The failed row still points cleanup at the stored original.
+    assert repo.get_result("timed-out").upload_object_key == "selfies/timed-out/upload.jpg"
+
+    # A run that finishes after its result failed neither resurrects it nor replaces its error.
+    assert not repo.mark_ready("timed-out", "u", "g", "f", "p")
+    assert not repo.mark_failed("timed-out", "Generation failed. Please try again.", internal_error_code="GENERATION_FAILED")
+    row = repo.get_result("timed-out")
+    assert (row.status, row.internal_error_code) == ("failed", "TIMED_OUT")
+    assert repo.mark_ready("live", "u", "g", "f", "p")
+
+    # Dropped even when no runnable job follows.
+    _queue(repo, "deleted", origin="web-1", now=1003.0)
+    repo.mark_failed("deleted", "Timed out. Please try again.", internal_error_code="TIMED_OUT")
+    assert repo.claim_job("web-1", now=1004.0, lease_seconds=60) is None
+    assert repo.get_job("deleted") is None
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import create_app
+from app.services.storage import LocalStorage, S3Storage
+
+
+def test_local_storage_roundtrip(tmp_path):
+    storage = LocalStorage(str(tmp_path / "objects"))
+
+    async def scenario():
+        url = await storage.upload_bytes("selfies/abc/final.png", b"png-bytes", "image/png")
+        assert url == "/local-storage/selfies/abc/final.png"
+        assert (tmp_path / "objects" / "selfies" / "abc" / "final.png").read_bytes() == b"png-bytes"
+        assert storage.presigned_get_url("selfies/abc/final.png", expires_in=60) == url
+        assert await storage.get_bytes("selfies/abc/final.png") == b"png-bytes"
+
+        await storage.delete_object("selfies/abc/final.png")
+        await storage.delete_object("selfies/abc/final.png")
+        assert not (tmp_path / "objects" / "selfies" / "abc" / "final.png").exists()
+
+    asyncio.run(scenario())
+
+
+def test_local_storage_rejects_keys_outside_root(tmp_path):
+    storage = LocalStorage(str(tmp_path / "objects"))
+    with pytest.raises(ValueError):
+        asyncio.run(storage.upload_bytes("../escape.png", b"x", "image/png"))
+
+
+def test_local_backend_serves_result_images(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path / "objects"))
+    app = create_app(validate_env=False)
+
+    with TestClient(app) as client:
+        final_key = "selfies/local-1/final.png"
+        asyncio.run(app.state.storage.upload_bytes(final_key, b"png-bytes", "image/png"))
+        now = datetime.now(timezone.utc)
+        app.state.repo.create_processing_result(
+            result_id="local-1",
+            created_at=now.isoformat(),
+            expires_at=(now + timedelta(days=1)).isoformat(),
+            prompt_version="v1",
+            user_agent_hash=None,
+            client_request_id=None,
+            ip_hash=None,
+        )
+        app.state.repo.mark_ready(
+            "local-1", "selfies/local-1/upload.jpg", "selfies/local-1/generated.jpg", final_key, "",
+            thumbnail_object_key="selfies/local-1/thumb.webp",
+        )
+
+        redirect = client.get("/api/selfie/result/local-1/image", follow_redirects=False)
+        assert redirect.status_code == 307
+        assert redirect.headers["location"] == f"/local-storage/{final_key}"
+        assert redirect.headers["cache-control"] == "public, max-age=1800"
+        assert client.get(redirect.headers["location"]).content == b"png-bytes"
+
+        thumbnail = client.get("/api/selfie/result/local-1/image?variant=thumbnail", follow_redirects=False)
+        assert thumbnail.headers["location"] == "/local-storage/selfies/local-1/thumb.webp"
+        assert client.get("/api/selfie/result/local-1/image?variant=card", follow_redirects=False).status_code == 404
+
+
+def test_s3_presigned_urls_are_reused_until_half_their_lifetime(monkeypatch):
+    now = [1_000_000.0]
+    storage = S3Storage(
+        endpoint_url="https://s3.eu-west-2.amazonaws.com",
+        bucket="bucket",
+        region="eu-west-2",
+        access_key="AKIAEXAMPLE",
+        secret_key="secret",
+        public_base_url="https://bucket.s3.eu-west-2.amazonaws.com",
+        presign_cache_size=2,
+        clock=lambda: now[0],
+    )
+    signed = []
+    monkeypatch.setattr(storage, "_sign", lambda key, expires_in, name: signed.append(key) or f"{key}?sig={len(signed)}")
+    try:
+        first = storage.presigned_get_url("a.png", expires_in=3600)
+        assert storage.presigned_get_url("a.png", expires_in=3600) == first
+        # A download URL carries its own Content-Disposition and is signed separately.
+        assert storage.presigned_get_url("a.png", expires_in=3600, download_filename="a.png") != first
+
+        now[0] += 1799
+        assert storage.presigned_get_url("a.png", expires_in=3600) == first
+        now[0] += 2
+        assert storage.presigned_get_url("a.png", expires_in=3600) != first
+        assert (storage.presign_hits, storage.presign_misses) == (2, 3)
+
+        storage.presigned_get_url("b.png", expires_in=3600)
+        storage.presigned_get_url("c.png", expires_in=3600)
+        assert len(storage._presigned) == 2
+    finally:
+        storage.close()
@@ -0,0 +1,61 @@
+import asyncio
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.config import Settings
+from app.main import create_app
+from app.services.results_repo import ResultsRepository
+from app.worker import run_worker
+
+
+def _photo_bytes() -> bytes:
+    img = Image.effect_noise((640, 640), 60).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_external_worker_runs_jobs_enqueued_by_web(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_DIR", str(tmp_path / "objects"))
+    monkeypatch.setenv("FAL_BACKEND", "fake")
+    monkeypatch.setenv("GEN_WORKER_MODE", "external")
+
+    app = create_app(validate_env=False)
+    with TestClient(app) as client:
+        assert app.state.dispatcher is None
+        response = client.post(
+            "/api/selfie/generate",
+            headers={"Origin": "http://localhost:8000"},
+            data={"client_request_id": "req-worker"},
+            files={"photo": ("photo.jpg", _photo_bytes(), "image/jpeg")},
+        )
+        assert response.status_code == 202
+    result_id = response.json()["result_id"]
+
+    repo = ResultsRepository(str(tmp_path / "results.db"))
+    job = repo.get_job(result_id)
+    # The web tier stored the upload and left the job queued for the worker.
+    assert job.upload_stored and job.attempts == 0
+    assert (tmp_path / "objects" / job.upload_object_key).exists()
+
+    async def scenario() -> None:
+        stop = asyncio.Event()
+        worker = asyncio.create_task(run_worker(Settings.load(validate=False), concurrency=2, cpu_workers=0, stop=stop))
+        for _ in range(200):
+            if repo.get_result(result_id).status != "processing":
+                break
+            await asyncio.sleep(0.05)
+        stop.set()
+        await worker
+
+    asyncio.run(scenario())
+
+    row = repo.get_result(result_id)
+    assert row.status == "ready"
+    assert repo.get_job(result_id) is None
+    with Image.open(tmp_path / "objects" / row.final_object_key) as final:
+        assert final.size == (1024, 1024)